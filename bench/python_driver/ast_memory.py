@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# Measures how much memory the nodes of a query's AST take up, and how much
+# the same nodes would take without slots. Run from this directory, or with
+# the driver on the path.
+#
+#   ./ast_memory.py
+
+import os
+import sys
+import types
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../drivers/python'))
+
+import rethinkdb as r
+from rethinkdb.ast import RqlQuery
+
+# The nodes of an AST, each once
+def walk(root):
+    seen = set()
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        yield node
+        stack.extend(node.args)
+        stack.extend(node.optargs.values())
+
+# The shallow size of a node and the containers that belong to it, shared
+# objects are only counted once
+def slotted_size(nodes):
+    seen = set()
+    size = 0
+    for node in nodes:
+        size += sys.getsizeof(node)
+        for obj in [getattr(node, '__dict__', None), node.args, node.optargs]:
+            if obj is not None and id(obj) not in seen:
+                seen.add(id(obj))
+                size += sys.getsizeof(obj)
+    return size
+
+# Nodes as they were before they were slotted, for comparison
+class Unslotted(object):
+    pass
+
+# The size the node would take without slots: its attributes are kept in an
+# instance dict, and it has its own list of args and dict of optargs unless
+# its class shares them, as Datum does
+def unslotted_size(nodes):
+    size = 0
+    for node in nodes:
+        copy = Unslotted()
+        copy.__dict__.update(getattr(node, '__dict__', { }))
+        for cls in type(node).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                # Slots that a subclass replaced with a class attribute
+                # aren't stored on the node
+                stored = isinstance(getattr(type(node), name), types.MemberDescriptorType)
+                if stored and hasattr(node, name):
+                    setattr(copy, name, getattr(node, name))
+        size += sys.getsizeof(copy) + sys.getsizeof(copy.__dict__)
+        if 'args' in copy.__dict__:
+            size += sys.getsizeof(list(node.args))
+        if 'optargs' in copy.__dict__:
+            size += sys.getsizeof(dict(node.optargs))
+    return size
+
+def main():
+    queries = [
+        ('insert of 5000 objects with a time',
+         lambda: r.table('t').insert([{'id': i, 'name': 'user %d' % i, 'at': r.now()} for i in xrange(5000)])),
+        ('5000 literals in a non-JSON array',
+         lambda: r.expr([r.now()] + range(5000))),
+        ('100 chained filters',
+         lambda: reduce(lambda q, i: q.filter(lambda row: row['x'] > i), xrange(100), r.table('t'))),
+    ]
+    print '%-40s %6s %16s %16s' % ('', 'nodes', 'without slots', 'slotted')
+    for name, build in queries:
+        nodes = list(walk(build()))
+        before = unslotted_size(nodes)
+        after = slotted_size(nodes)
+        print '%-40s %6d %9d bytes %9d bytes  %5.1f -> %5.1f bytes/node' % \
+            (name, len(nodes), before, after, float(before) / len(nodes), float(after) / len(nodes))
+
+if __name__ == '__main__':
+    main()
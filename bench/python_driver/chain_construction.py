@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# Measures how long it takes to build long chains of terms that take
+# functions written with `r.row`. Run from this directory, or with the driver
+# on the path.
+#
+#   ./chain_construction.py
+
+import os
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../drivers/python'))
+
+import rethinkdb as r
+
+def filter_chain(n):
+    query = r.table('t')
+    for i in xrange(n):
+        query = query.filter(r.row['x'] > i)
+    return query
+
+def order_by_chain(n):
+    query = r.table('t')
+    for i in xrange(n):
+        query = query.order_by(r.desc(r.row['x'] + i))
+    return query
+
+# Every step wraps the previous steps, as with nested subqueries
+def nested_filters(n):
+    predicate = r.row['x'] > 0
+    for i in xrange(n):
+        predicate = r.table('t').filter(predicate).count() > i
+    return predicate
+
+def best_time(build, n, repeat=5):
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        build(n)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def main():
+    sys.setrecursionlimit(10000)
+    for build in [filter_chain, order_by_chain, nested_filters]:
+        for n in [100, 200, 400]:
+            elapsed = best_time(build, n)
+            print '%-16s %4d steps %9.2fms %7.1fus/step' % (build.__name__, n, elapsed * 1000, elapsed * 1e6 / n)
+
+if __name__ == '__main__':
+    main()
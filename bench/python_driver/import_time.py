@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# Measures how long `import rethinkdb` takes in a new interpreter, and checks
+# that it doesn't load the protobuf messages. Run from this directory, or with
+# the driver on the path.
+#
+#   ./import_time.py
+
+import os
+import subprocess
+import sys
+
+driver_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../drivers/python')
+
+script = '''
+import sys, time
+start = time.time()
+import rethinkdb
+elapsed = time.time() - start
+print elapsed, 'rethinkdb.ql2_pb2' in sys.modules, 'rethinkdb.docs' in sys.modules
+'''
+
+def import_time(repeat=10):
+    env = dict(os.environ, PYTHONPATH=driver_dir)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+
+    best = None
+    for _ in xrange(repeat):
+        out = subprocess.check_output([sys.executable, '-c', script], env=env).split()
+        elapsed = float(out[0])
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, out[1] == 'True', out[2] == 'True'
+
+def main():
+    elapsed, protobuf, docs = import_time()
+    print '%7.2fms  protobuf loaded: %-5s  docs loaded: %s' % (elapsed * 1000, protobuf, docs)
+
+if __name__ == '__main__':
+    main()
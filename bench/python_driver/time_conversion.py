@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# Measures how long it takes to decode a batch of rows with a time each, row
+# by row and as a batch, for each time_format. Run from this directory, or
+# with the driver on the path.
+#
+#   ./time_conversion.py
+
+import json
+import os
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../drivers/python'))
+
+from rethinkdb.ast import Datum, deconstruct_batch
+from rethinkdb.decode import JsonDatum
+
+def make_batch(rows):
+    return [JsonDatum(json.dumps({'id': i, 'level': 'info', 'message': 'request %d served' % i,
+                                  'at': {'$reql_type$': 'TIME', 'epoch_time': 1390000000.123 + i, 'timezone': '-07:00'}}))
+            for i in xrange(rows)]
+
+def best_time(decode, repeat=20):
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        decode()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def main():
+    batch = make_batch(1000)
+    for time_format in ['native', 'epoch', 'raw']:
+        per_row = best_time(lambda: [Datum.deconstruct(datum, time_format) for datum in batch])
+        batched = best_time(lambda: deconstruct_batch(batch, time_format))
+        print '%-6s 1000 rows  by row %7.2fms  as a batch %7.2fms' % (time_format, per_row * 1000, batched * 1000)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# Copyright 2010-2013 RethinkDB, all rights reserved.
+
+# Writes the enum values of ql2.proto as a plain Python module, so that the
+# driver can build queries without loading the protobuf messages. The values
+# are attributes of a class per message, like they are in ql2_pb2.
+#
+#   ./gen_ql2_enums.py ql2.proto > rethinkdb/ql2_enums.py
+
+import re
+import sys
+
+_comment = re.compile(r'//[^\n]*')
+_token = re.compile(r'\s*(message|enum)\s+(\w+)\s*{|\s*(\w+)\s*=\s*(0x[0-9a-fA-F]+|-?\d+)\s*;|\s*}|[^{};]*;|\s*\S')
+
+def parse_enums(proto):
+    messages = [ ]
+    scopes = [ ]
+    for match in _token.finditer(_comment.sub('', proto)):
+        keyword, name, value_name, value = match.groups()
+        token = match.group(0).strip()
+        if keyword == 'message':
+            scopes.append(('message', name))
+            messages.append((name, [ ]))
+        elif keyword == 'enum':
+            scopes.append(('enum', name))
+        elif token == '}':
+            scopes.pop()
+        elif value_name is not None and scopes and scopes[-1][0] == 'enum':
+            # Enum values belong to the message the enum is declared in
+            message = [scope for kind, scope in scopes if kind == 'message'][-1]
+            for message_name, values in messages:
+                if message_name == message:
+                    values.append((value_name, int(value, 0)))
+    return [(name, values) for name, values in messages if values]
+
+def main():
+    proto = open(sys.argv[1]).read()
+    print '# Generated by gen_ql2_enums.py from ql2.proto, do not edit'
+    for name, values in parse_enums(proto):
+        print
+        print 'class %s(object):' % name
+        for value_name, value in values:
+            print '    %s = %d' % (value_name, value)
+
+if __name__ == '__main__':
+    main()
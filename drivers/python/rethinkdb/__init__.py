@@ -1,7 +1,11 @@
 # This file includes all public facing Python API functions
 
-from .net import connect, Connection, Cursor, protobuf_implementation
+from .net import connect, Connection, MultiplexedConnection, Cursor, protobuf_implementation
 from .query import js, json, error, do, row, table, db, db_create, db_drop, db_list, table_create, table_drop, table_list, branch, count, sum, avg, asc, desc, eq, ne, le, ge, lt, gt, any, all, add, sub, mul, div, mod, type_of, info, time, monday, tuesday, wednesday, thursday, friday, saturday, sunday, january, february, march, april, may, june, july, august, september, october, november, december, iso8601, epoch_time, now, literal, make_timezone, and_, or_, not_, object
-from .errors import RqlError, RqlClientError, RqlCompileError, RqlRuntimeError, RqlDriverError
-from .ast import expr, exprJSON, RqlQuery
+from .pool import ConnectionPool
+from .bulk import BulkWriter
+from .prepared import prepare
+from .instrument import QueryStats, SlowQueryLog
+from .errors import RqlError, RqlClientError, RqlCompileError, RqlRuntimeError, RqlDriverError, RqlTimeoutError
+from .ast import expr, exprJSON, RqlQuery, set_json_decoder
 import rethinkdb.docs
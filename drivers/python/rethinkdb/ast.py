@@ -1,13 +1,15 @@
-from . import ql2_pb2 as p
+from . import ql2_enums as p
 import types
 import sys
+import math
 import datetime
 import numbers
 import collections
 import time
 import re
 import json as py_json
-from threading import Lock
+import importlib
+from threading import local
 from .errors import *
 from . import repl # For the repl connection
 
@@ -22,6 +24,8 @@ def expr(val, nesting_depth=20):
 
     if isinstance(val, RqlQuery):
         return val
+    elif isinstance(val, list) or isinstance(val, dict):
+        return _literal(val, _pack(val, nesting_depth))
     elif isinstance(val, datetime.datetime) or isinstance(val, datetime.date):
         if not hasattr(val, 'tzinfo') or not val.tzinfo:
             raise RqlDriverError("""Cannot convert %s to ReQL time object
@@ -31,72 +35,93 @@ def expr(val, nesting_depth=20):
             use one of ReQL's bultin time constructors, r.now, r.time, or r.iso8601.
             """ % (type(val).__name__))
         return ISO8601(val.isoformat())
-    elif isinstance(val, list):
-        val = [expr(v, nesting_depth - 1) for v in val]
-        return MakeArray(*val)
-    elif isinstance(val, dict):
-        # MakeObj doesn't take the dict as a keyword args to avoid
-        # conflicting with the `self` parameter.
-        obj = {}
-        for k in val.keys():
-            obj[k] = expr(val[k], nesting_depth - 1)
-        return MakeObj(obj)
     elif isinstance(val, collections.Callable):
         return Func(val)
     else:
         return Datum(val)
 
-# Like expr but attempts to serialize as much of the value as JSON
-# as possible.
-def exprJSON(val, nesting_depth=20):
+# Converts the parts of a list or dict that aren't plain JSON in a single pass.
+# Returns None if the whole value is JSON, otherwise the query for the value
+# with every JSON subtree packed into a single JsonLiteral.
+def _pack(val, nesting_depth):
     if nesting_depth <= 0:
         raise RqlDriverError("Nesting depth limit exceeded")
 
-    if isinstance(val, RqlQuery):
-        return val
-    elif isJSON(val, nesting_depth):
-        return Json(py_json.dumps(val))
+    if isinstance(val, list):
+        packed = [_pack(v, nesting_depth - 1) for v in val]
+        if all(q is None for q in packed):
+            return None
+        return MakeArray(*[_literal(v, q) for v, q in zip(val, packed)])
     elif isinstance(val, dict):
-        copy = val.copy()
-        for k,v in copy.items():
-            copy[k] = exprJSON(v, nesting_depth)
-        return MakeObj(copy)
-    elif isinstance(val, list):
-        copy = []
-        for v in val:
-            copy.append(exprJSON(v, nesting_depth))
-        return MakeArray(*copy)
+        packed = { }
+        is_json = True
+        for k, v in val.iteritems():
+            q = _pack(v, nesting_depth - 1)
+            packed[k] = q
+            if q is not None or not isinstance(k, types.StringTypes):
+                is_json = False
+        if is_json:
+            return None
+        # MakeObj doesn't take the dict as a keyword args to avoid
+        # conflicting with the `self` parameter.
+        return MakeObj(dict((k, _literal(val[k], q)) for k, q in packed.iteritems()))
+    elif _is_json_scalar(val):
+        return None
     else:
-        # Default to datum serialization
-        return expr(val, nesting_depth - 1)
-
-def isJSON(val, nesting_depth=20):
-    if nesting_depth <= 0:
-        raise RqlDriverError("Nesting depth limit exceeded")
+        return expr(val, nesting_depth)
 
-    if isinstance(val, RqlQuery):
-        return False
-    elif isinstance(val, dict):
-        return all([isinstance(k, types.StringTypes) and isJSON(v, nesting_depth - 1) for k,v in val.items()])
-    elif isinstance(val, list):
-        return all([isJSON(v, nesting_depth - 1) for v in val])
-    elif isinstance(val, (int, float, str, unicode, bool)):
+def _is_json_scalar(val):
+    if val is None or isinstance(val, (bool, int, long, str, unicode)):
         return True
+    # NaN and infinity aren't valid JSON
+    return isinstance(val, float) and not (math.isnan(val) or math.isinf(val))
+
+def _literal(val, packed):
+    if packed is not None:
+        return packed
+    elif isinstance(val, list) or isinstance(val, dict):
+        return JsonLiteral(val)
     else:
-        return False
+        return Datum(val)
 
+# Kept for backwards compatibility, `expr` packs JSON values the same way
+def exprJSON(val, nesting_depth=20):
+    return expr(val, nesting_depth)
+
+# The optargs of terms that have none, shared between them
+class _NoOptargs(dict):
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("The optargs of a term without any cannot be modified.")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+
+_no_optargs = _NoOptargs()
+
+# Nodes are slotted and keep their args in a tuple, as queries can be made of
+# many thousands of them. Subclasses have to declare `__slots__` as well.
+#
+# `has_ivar` is set on nodes that have an IMPLICIT_VAR term in their subtree,
+# so that `func_wrap` doesn't have to scan the arguments it wraps.
 class RqlQuery(object):
+    __slots__ = ('args', 'optargs', 'has_ivar')
 
     # Instantiate this AST node with the given pos and opt args
     def __init__(self, *args, **optargs):
-        self.args = [expr(e) for e in args]
+        self.args = tuple([expr(e) for e in args])
 
-        self.optargs = {}
+        self.optargs = _no_optargs
         for k in optargs.keys():
             if not isinstance(optargs[k], RqlQuery) and optargs[k] == ():
                 continue
+            if self.optargs is _no_optargs:
+                self.optargs = {}
             self.optargs[k] = expr(optargs[k])
 
+        self.has_ivar = any([arg.has_ivar for arg in self.args]) or \
+                        any([arg.has_ivar for arg in self.optargs.itervalues()])
+
     # Send this query to the server to be executed
     def run(self, c=None, **global_opt_args):
         if not c:
@@ -107,6 +132,17 @@ class RqlQuery(object):
 
         return c._start(self, **global_opt_args)
 
+    # Send this query without waiting for the response, returns a future for
+    # the result. Requires a multiplexed connection.
+    def run_async(self, c=None, **global_opt_args):
+        if not c:
+            if repl.default_connection:
+                c = repl.default_connection
+            else:
+                raise RqlDriverError("RqlQuery.run_async must be given a connection to run on.")
+
+        return c._start_async(self, **global_opt_args)
+
     def __str__(self):
         qp = QueryPrinter(self)
         return qp.print_query()
@@ -489,9 +525,10 @@ class RqlQuery(object):
 # These classes define how nodes are printed by overloading `compose`
 
 def needs_wrap(arg):
-    return isinstance(arg, Datum) or isinstance(arg, MakeArray) or isinstance(arg, MakeObj)
+    return isinstance(arg, Datum) or isinstance(arg, MakeArray) or isinstance(arg, MakeObj) or isinstance(arg, JsonLiteral)
 
 class RqlBoolOperQuery(RqlQuery):
+    __slots__ = ('infix',)
     def __init__(self, *args, **optargs):
         if 'infix' in optargs:
             self.infix = optargs['infix']
@@ -510,11 +547,13 @@ class RqlBoolOperQuery(RqlQuery):
             return T('r.', self.st, '(', T(*t_args, intsp=', '), ')')
 
 class RqlBiOperQuery(RqlQuery):
+    __slots__ = ()
     def compose(self, args, optargs):
         t_args = [T('r.expr(', args[i], ')') if needs_wrap(self.args[i]) else args[i] for i in xrange(len(args))]
         return T('(', T(*t_args, intsp=[' ', self.st, ' ']), ')')
 
 class RqlBiCompareOperQuery(RqlBiOperQuery):
+    __slots__ = ()
     def __init__(self, *args, **optargs):
         RqlBiOperQuery.__init__(self, *args, **optargs)
 
@@ -531,11 +570,13 @@ class RqlBiCompareOperQuery(RqlBiOperQuery):
                 pass # No infix attribute, so not possible to be an infix bool operator
 
 class RqlTopLevelQuery(RqlQuery):
+    __slots__ = ()
     def compose(self, args, optargs):
         args.extend([T(k, '=', v) for k,v in optargs.items()])
         return T('r.', self.st, '(', T(*(args), intsp=', '), ')')
 
 class RqlMethodQuery(RqlQuery):
+    __slots__ = ()
     def compose(self, args, optargs):
         if needs_wrap(self.args[0]):
             args[0] = T('r.expr(', args[0], ')')
@@ -547,6 +588,7 @@ class RqlMethodQuery(RqlQuery):
         return T(args[0], '.', self.st, '(', restargs, ')')
 
 class RqlBracketQuery(RqlMethodQuery):
+    __slots__ = ('bracket_operator',)
     def __init__(self, *args, **optargs):
         if 'bracket_operator' in optargs:
             self.bracket_operator = optargs['bracket_operator']
@@ -587,14 +629,31 @@ class RqlTzinfo(datetime.tzinfo):
     def dst(self, dt):
         return datetime.timedelta(0)
 
-def reql_type_time_to_datetime(obj):
+# Times with the same offset share its RqlTzinfo
+_tzinfos = { }
+
+def _tzinfo(offsetstr):
+    tzinfo = _tzinfos.get(offsetstr)
+    if tzinfo is None:
+        tzinfo = RqlTzinfo(offsetstr)
+        _tzinfos[offsetstr] = tzinfo
+    return tzinfo
+
+def reql_type_time_to_epoch(obj):
     if not 'epoch_time' in obj:
         raise RqlDriverError('pseudo-type TIME object %s does not have expected field "epoch_time".' % py_json.dumps(obj))
+    return obj['epoch_time']
+
+def reql_type_time_to_datetime(obj):
+    epoch_time = reql_type_time_to_epoch(obj)
 
     if 'timezone' in obj:
-        return datetime.datetime.fromtimestamp(obj['epoch_time'], RqlTzinfo(obj['timezone']))
+        # The same as `fromtimestamp(epoch_time, tzinfo)`, without calling
+        # back into the tzinfo
+        tzinfo = _tzinfo(obj['timezone'])
+        return (datetime.datetime.utcfromtimestamp(epoch_time) + tzinfo.delta).replace(tzinfo=tzinfo)
     else:
-        return datetime.datetime.utcfromtimestamp(obj['epoch_time'])
+        return datetime.datetime.utcfromtimestamp(epoch_time)
 
 # This class handles the conversion of RQL terminal types in both directions
 # Going to the server though it does not support R_ARRAY or R_OBJECT as those
@@ -604,8 +663,10 @@ def reql_type_time_to_datetime(obj):
 # R_ARRAYs and R_OBJECTs would require verifying that at all nested levels
 # our arrays and objects are composed only of basic types.
 class Datum(RqlQuery):
-    args = []
-    optargs = {}
+    __slots__ = ('data',)
+    args = ()
+    optargs = _no_optargs
+    has_ivar = False
 
     def __init__(self, val):
         self.data = val
@@ -638,6 +699,9 @@ class Datum(RqlQuery):
                 if time_format == 'native':
                     # Convert to native python datetime object
                     return reql_type_time_to_datetime(obj)
+                elif time_format == 'epoch':
+                    # Seconds since the epoch as a float
+                    return float(reql_type_time_to_epoch(obj))
                 elif time_format != 'raw':
                     raise RqlDriverError("Unknown time_format run option \"%s\"." % time_format)
             else:
@@ -645,23 +709,11 @@ class Datum(RqlQuery):
         # If there was no pseudotype, or the time format is raw, return the original object
         return obj
 
-    @staticmethod
-    def _recursively_convert_pseudotypes(obj, time_format):
-        if isinstance(obj, dict):
-            for (key, value) in obj.iteritems():
-                obj[key] = Datum._recursively_convert_pseudotypes(value, time_format)
-            obj = Datum._convert_pseudotype(obj, time_format)
-        elif isinstance(obj, list):
-            for i in xrange(len(obj)):
-                obj[i] = Datum._recursively_convert_pseudotypes(obj[i], time_format)
-        return obj
-
     @staticmethod
     def deconstruct(datum, time_format='native'):
         d_type = datum.type
         if d_type == p.Datum.R_JSON:
-            obj = py_json.loads(datum.r_str)
-            return Datum._recursively_convert_pseudotypes(obj, time_format)
+            return _decode_json(datum.r_str, time_format)
         elif d_type == p.Datum.R_OBJECT:
             obj = { }
             for pair in datum.r_object:
@@ -671,8 +723,7 @@ class Datum(RqlQuery):
             # be an object or something else. We need a second layer of type switching, this
             # time on an obfuscated field "$reql_type$" rather than the datum type field we
             # already switched on.
-            Datum._convert_pseudotype(obj, time_format)
-            return obj
+            return Datum._convert_pseudotype(obj, time_format)
         elif d_type == p.Datum.R_ARRAY:
             array = datum.r_array
             return [Datum.deconstruct(e, time_format) for e in array]
@@ -695,7 +746,143 @@ class Datum(RqlQuery):
         else:
             raise RuntimeError("Unknown Datum type %d encountered in response." % datum.type)
 
+# Responses are decoded with the JSON module set with `set_json_decoder`.
+# Pseudo-types are converted while decoding, by decoders that are only used
+# when a response contains any.
+_json_module = py_json
+_json_decoder = py_json.JSONDecoder()
+_pseudotype_decoders = { }
+
+def set_json_decoder(module):
+    '''
+        Set the JSON module used to decode query results, given either as the
+        module or its name. Any module with the `JSONDecoder` class of the
+        standard `json` module works, like `simplejson`.
+    '''
+    global _json_module, _json_decoder, _pseudotype_decoders
+    if isinstance(module, types.StringTypes):
+        try:
+            module = importlib.import_module(module)
+        except ImportError as err:
+            raise RqlDriverError("Could not import JSON decoder %s: %s" % (module, err))
+    if not hasattr(module, 'JSONDecoder'):
+        raise RqlDriverError("JSON decoder %s does not have a JSONDecoder class." % module.__name__)
+
+    _json_module = module
+    _json_decoder = module.JSONDecoder()
+    _pseudotype_decoders = { }
+
+def _pseudotype_decoder(time_format):
+    decoder = _pseudotype_decoders.get(time_format)
+    if decoder is None:
+        def convert(pairs):
+            obj = dict(pairs)
+            if '$reql_type$' in obj:
+                return Datum._convert_pseudotype(obj, time_format)
+            return obj
+        decoder = _json_module.JSONDecoder(object_pairs_hook=convert)
+        _pseudotype_decoders[time_format] = decoder
+    return decoder
+
+_json_whitespace = re.compile(r'[ \t\n\r]*')
+
+# The strings and brackets of a JSON text, everything else is skipped
+_json_token = re.compile(r'("[^"\\]*(?:\\.[^"\\]*)*")|([{\[])|[}\]]')
+
+# Keys made of these characters can only be written one way in JSON
+_json_plain_key = re.compile(r'[\w$ .\-]*\Z')
+
+# A read-only mapping over a JSON object that only decodes the fields that
+# are accessed, for reading a few fields of large documents. Fields are found
+# by searching the JSON text for their key, and pseudo-types are converted
+# per field. Anything that needs all of the keys decodes the whole document,
+# which `to_dict` returns.
+class LazyDocument(collections.Mapping):
+    def __init__(self, json_str, time_format='native'):
+        self._json = json_str
+        self._time_format = time_format
+        self._fields = { }
+        self._dict = None
+
+    # Returns the position of the value of a field, or -1 if there's no such
+    # field. The text is scanned once up to the key, keeping track of the
+    # nesting depth: a string at depth 1 that is followed by a colon is a key
+    # of this object.
+    def _find_value(self, key):
+        json_str = self._json
+        quoted = '"%s"' % key
+        if quoted not in json_str:
+            return -1
+        depth = 0
+        for token in _json_token.finditer(json_str):
+            if token.lastindex == 2:
+                depth += 1
+            elif token.lastindex is None:
+                depth -= 1
+            elif depth == 1 and token.group(1) == quoted:
+                end = _json_whitespace.match(json_str, token.end()).end()
+                if json_str.startswith(':', end):
+                    return _json_whitespace.match(json_str, end + 1).end()
+        return -1
+
+    def __getitem__(self, key):
+        if self._dict is not None:
+            return self._dict[key]
+        if key in self._fields:
+            return self._fields[key]
+        if not isinstance(key, types.StringTypes) or not _json_plain_key.match(key):
+            return self.to_dict()[key]
+
+        start = self._find_value(key)
+        if start == -1:
+            raise KeyError(key)
+        value, end = _json_decoder.raw_decode(self._json, start)
+        if self._json.find('$reql_type$', start, end) != -1:
+            value = _pseudotype_decoder(self._time_format).raw_decode(self._json, start)[0]
+        self._fields[key] = value
+        return value
+
+    def __iter__(self):
+        return iter(self.to_dict())
+
+    def __len__(self):
+        return len(self.to_dict())
+
+    def to_dict(self):
+        if self._dict is None:
+            self._dict = _decode_json(self._json, self._time_format)
+            self._fields = None
+        return self._dict
+
+    def __repr__(self):
+        return "<LazyDocument %s>" % self._json
+
+def _decode_json(json_str, time_format):
+    if '$reql_type$' not in json_str:
+        return _json_decoder.decode(json_str)
+    return _pseudotype_decoder(time_format).decode(json_str)
+
+# Decodes the datum into a LazyDocument if it's an object, other values are
+# decoded as usual
+def lazy_deconstruct(datum, time_format='native'):
+    if datum.type != p.Datum.R_JSON or not datum.r_str.lstrip().startswith('{'):
+        return Datum.deconstruct(datum, time_format)
+    doc = LazyDocument(datum.r_str, time_format)
+    if '$reql_type$' in datum.r_str and '$reql_type$' in doc:
+        # The document itself is a pseudo-type
+        return doc.to_dict()
+    return doc
+
+# Decodes the datums of a batch. Batches of R_JSON datums are decoded as a
+# single JSON array, which saves the decoder's overhead for each row.
+def deconstruct_batch(datums, time_format='native'):
+    for datum in datums:
+        if datum.type != p.Datum.R_JSON:
+            return [Datum.deconstruct(datum, time_format) for datum in datums]
+    return _decode_json('[%s]' % ','.join([datum.r_str for datum in datums]), time_format)
+
 class MakeArray(RqlQuery):
+    __slots__ = ()
     tt = p.Term.MAKE_ARRAY
 
     def compose(self, args, optargs):
@@ -705,72 +892,116 @@ class MakeArray(RqlQuery):
         return FunCall(func_wrap(func), self)
 
 class MakeObj(RqlQuery):
+    __slots__ = ()
     tt = p.Term.MAKE_OBJ
 
     # We cannot inherit from RqlQuery because of potential conflicts with
     # the `self` parameter. This is not a problem for other RqlQuery sub-
     # classes unless we add a 'self' optional argument to one of them.
     def __init__(self, obj_dict):
-        self.args = []
+        self.args = ()
 
-        self.optargs = {}
+        self.optargs = { } if obj_dict else _no_optargs
         for k in obj_dict.keys():
             if not isinstance(k, types.StringTypes):
                 raise RqlDriverError("Object keys must be strings.");
             self.optargs[k] = expr(obj_dict[k])
 
+        self.has_ivar = any([arg.has_ivar for arg in self.optargs.itervalues()])
+
     def compose(self, args, optargs):
         return T('{', T(*[T(repr(name), ': ', optargs[name]) for name in optargs.keys()], intsp=', '), '}')
 
+# A list or dict of plain JSON values, sent as a single JSON term instead of a
+# term for every element. Prints like the MakeArray and MakeObj terms it
+# stands for.
+class JsonLiteral(RqlQuery):
+    __slots__ = ('data',)
+    tt = p.Term.JSON
+    has_ivar = False
+
+    def __init__(self, val):
+        self.data = val
+        self.args = (Datum(py_json.dumps(val)),)
+        self.optargs = _no_optargs
+
+    def compose(self, args, optargs):
+        return JsonLiteral._compose_value(self.data)
+
+    @staticmethod
+    def _compose_value(val):
+        if isinstance(val, list):
+            return T('[', T(*[JsonLiteral._compose_value(v) for v in val], intsp=', '), ']')
+        elif isinstance(val, dict):
+            return T('{', T(*[T(repr(k), ': ', JsonLiteral._compose_value(v)) for k, v in val.items()], intsp=', '), '}')
+        else:
+            return repr(val)
+
 class Var(RqlQuery):
+    __slots__ = ()
     tt = p.Term.VAR
 
     def compose(self, args, optargs):
         return 'var_'+args[0]
 
 class JavaScript(RqlTopLevelQuery):
+    __slots__ = ()
     tt = p.Term.JAVASCRIPT
     st = "js"
 
 class UserError(RqlTopLevelQuery):
+    __slots__ = ()
     tt = p.Term.ERROR
     st = "error"
 
 class Default(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.DEFAULT
     st = "default"
 
+# No slots, `r.row` is the only instance and the docs set its `__doc__`
 class ImplicitVar(RqlQuery):
     tt = p.Term.IMPLICIT_VAR
 
+    def __init__(self):
+        RqlQuery.__init__(self)
+        self.has_ivar = True
+
     def compose(self, args, optargs):
         return 'r.row'
 
 class Eq(RqlBiCompareOperQuery):
+    __slots__ = ()
     tt = p.Term.EQ
     st = "=="
 
 class Ne(RqlBiCompareOperQuery):
+    __slots__ = ()
     tt = p.Term.NE
     st = "!="
 
 class Lt(RqlBiCompareOperQuery):
+    __slots__ = ()
     tt = p.Term.LT
     st = "<"
 
 class Le(RqlBiCompareOperQuery):
+    __slots__ = ()
     tt = p.Term.LE
     st = "<="
 
 class Gt(RqlBiCompareOperQuery):
+    __slots__ = ()
     tt = p.Term.GT
     st = ">"
 
 class Ge(RqlBiCompareOperQuery):
+    __slots__ = ()
     tt = p.Term.GE
     st = ">="
 
 class Not(RqlQuery):
+    __slots__ = ()
     tt = p.Term.NOT
 
     def compose(self, args, optargs):
@@ -779,54 +1010,67 @@ class Not(RqlQuery):
         return T('(~', args[0], ')')
 
 class Add(RqlBiOperQuery):
+    __slots__ = ()
     tt = p.Term.ADD
     st = "+"
 
 class Sub(RqlBiOperQuery):
+    __slots__ = ()
     tt = p.Term.SUB
     st = "-"
 
 class Mul(RqlBiOperQuery):
+    __slots__ = ()
     tt = p.Term.MUL
     st = "*"
 
 class Div(RqlBiOperQuery):
+    __slots__ = ()
     tt = p.Term.DIV
     st = "/"
 
 class Mod(RqlBiOperQuery):
+    __slots__ = ()
     tt = p.Term.MOD
     st = "%"
 
 class Append(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.APPEND
     st = "append"
 
 class Prepend(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.PREPEND
     st = "prepend"
 
 class Difference(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.DIFFERENCE
     st = "difference"
 
 class SetInsert(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.SET_INSERT
     st = "set_insert"
 
 class SetUnion(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.SET_UNION
     st = "set_union"
 
 class SetIntersection(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.SET_INTERSECTION
     st = "set_intersection"
 
 class SetDifference(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.SET_DIFFERENCE
     st = "set_difference"
 
 class Slice(RqlBracketQuery):
+    __slots__ = ()
     tt = p.Term.SLICE
     st = 'slice'
 
@@ -840,54 +1084,67 @@ class Slice(RqlBracketQuery):
             return RqlBracketQuery.compose(self, args, optargs)
 
 class Skip(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.SKIP
     st = 'skip'
 
 class Limit(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.LIMIT
     st = 'limit'
 
 class GetField(RqlBracketQuery):
+    __slots__ = ()
     tt = p.Term.GET_FIELD
     st = 'get_field'
 
 class Contains(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.CONTAINS
     st = 'contains'
 
 class HasFields(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.HAS_FIELDS
     st = 'has_fields'
 
 class WithFields(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.WITH_FIELDS
     st = 'with_fields'
 
 class Keys(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.KEYS
     st = 'keys'
 
 class Object(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.OBJECT
     st = 'object'
 
 class Pluck(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.PLUCK
     st = 'pluck'
 
 class Without(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.WITHOUT
     st = 'without'
 
 class Merge(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.MERGE
     st = 'merge'
 
 class Between(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.BETWEEN
     st = 'between'
 
 class DB(RqlTopLevelQuery):
+    __slots__ = ()
     tt = p.Term.DB
     st = 'db'
 
@@ -904,6 +1161,7 @@ class DB(RqlTopLevelQuery):
         return Table(self, table_name, use_outdated=use_outdated)
 
 class FunCall(RqlQuery):
+    __slots__ = ()
     tt = p.Term.FUNCALL
 
     def compose(self, args, optargs):
@@ -916,6 +1174,7 @@ class FunCall(RqlQuery):
         return T(args[1], '.do(', args[0], ')')
 
 class Table(RqlQuery):
+    __slots__ = ()
     tt = p.Term.TABLE
     st = 'table'
 
@@ -956,296 +1215,369 @@ class Table(RqlQuery):
             return T('r.table(', args[0], ')')
 
 class Get(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.GET
     st = 'get'
 
 class GetAll(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.GET_ALL
     st = 'get_all'
 
 class Reduce(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.REDUCE
     st = 'reduce'
 
 class Map(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.MAP
     st = 'map'
 
 class Filter(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.FILTER
     st = 'filter'
 
 class ConcatMap(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.CONCATMAP
     st = 'concat_map'
 
 class OrderBy(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.ORDERBY
     st = 'order_by'
 
 class Distinct(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.DISTINCT
     st = 'distinct'
 
 class Count(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.COUNT
     st = 'count'
 
 class Union(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.UNION
     st = 'union'
 
 class Nth(RqlBracketQuery):
+    __slots__ = ()
     tt = p.Term.NTH
     st = 'nth'
 
 class Match(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.MATCH
     st = 'match'
 
 class Upcase(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.UPCASE
     st = 'upcase'
 
 class Downcase(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.DOWNCASE
     st = 'downcase'
 
 class IndexesOf(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.INDEXES_OF
     st = 'indexes_of'
 
 class IsEmpty(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.IS_EMPTY
     st = 'is_empty'
 
 class GroupedMapReduce(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.GROUPED_MAP_REDUCE
     st = 'grouped_map_reduce'
 
 class GroupBy(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.GROUPBY
     st = 'group_by'
 
 class InnerJoin(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.INNER_JOIN
     st = 'inner_join'
 
 class OuterJoin(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.OUTER_JOIN
     st = 'outer_join'
 
 class EqJoin(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.EQ_JOIN
     st = 'eq_join'
 
 class Zip(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.ZIP
     st = 'zip'
 
 class CoerceTo(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.COERCE_TO
     st = 'coerce_to'
 
 class TypeOf(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.TYPEOF
     st = 'type_of'
 
 class Update(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.UPDATE
     st = 'update'
 
 class Delete(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.DELETE
     st = 'delete'
 
 class Replace(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.REPLACE
     st = 'replace'
 
 class Insert(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.INSERT
     st = 'insert'
 
 class DbCreate(RqlTopLevelQuery):
+    __slots__ = ()
     tt = p.Term.DB_CREATE
     st = "db_create"
 
 class DbDrop(RqlTopLevelQuery):
+    __slots__ = ()
     tt = p.Term.DB_DROP
     st = "db_drop"
 
 class DbList(RqlTopLevelQuery):
+    __slots__ = ()
     tt = p.Term.DB_LIST
     st = "db_list"
 
 class TableCreate(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.TABLE_CREATE
     st = "table_create"
 
 class TableCreateTL(RqlTopLevelQuery):
+    __slots__ = ()
     tt = p.Term.TABLE_CREATE
     st = "table_create"
 
 class TableDrop(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.TABLE_DROP
     st = "table_drop"
 
 class TableDropTL(RqlTopLevelQuery):
+    __slots__ = ()
     tt = p.Term.TABLE_DROP
     st = "table_drop"
 
 class TableList(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.TABLE_LIST
     st = "table_list"
 
 class TableListTL(RqlTopLevelQuery):
+    __slots__ = ()
     tt = p.Term.TABLE_LIST
     st = "table_list"
 
 class IndexCreate(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.INDEX_CREATE
     st = 'index_create'
 
 class IndexDrop(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.INDEX_DROP
     st = 'index_drop'
 
 class IndexList(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.INDEX_LIST
     st = 'index_list'
 
 class IndexStatus(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.INDEX_STATUS
     st = 'index_status'
 
 class IndexWait(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.INDEX_WAIT
     st = 'index_wait'
 
 class Sync(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.SYNC
     st = 'sync'
 
 class Branch(RqlTopLevelQuery):
+    __slots__ = ()
     tt = p.Term.BRANCH
     st = "branch"
 
 class Any(RqlBoolOperQuery):
+    __slots__ = ()
     tt = p.Term.ANY
     st = "or_"
     st_infix = "|"
 
 class All(RqlBoolOperQuery):
+    __slots__ = ()
     tt = p.Term.ALL
     st = "and_"
     st_infix = "&"
 
 class ForEach(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.FOREACH
     st = 'for_each'
 
 class Info(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.INFO
     st = 'info'
 
 class InsertAt(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.INSERT_AT
     st = 'insert_at'
 
 class SpliceAt(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.SPLICE_AT
     st = 'splice_at'
 
 class DeleteAt(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.DELETE_AT
     st = 'delete_at'
 
 class ChangeAt(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.CHANGE_AT
     st = 'change_at'
 
 class Sample(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.SAMPLE
     st = 'sample'
 
 class Json(RqlTopLevelQuery):
+    __slots__ = ()
     tt = p.Term.JSON
     st = 'json'
 
 class ToISO8601(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.TO_ISO8601
     st = 'to_iso8601'
 
 class During(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.DURING
     st = 'during'
 
 class Date(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.DATE
     st = 'date'
 
 class TimeOfDay(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.TIME_OF_DAY
     st = 'time_of_day'
 
 class Timezone(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.TIMEZONE
     st = 'timezone'
 
 class Year(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.YEAR
     st = 'year'
 
 class Month(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.MONTH
     st = 'month'
 
 class Day(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.DAY
     st = 'day'
 
 class DayOfWeek(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.DAY_OF_WEEK
     st = 'day_of_week'
 
 class DayOfYear(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.DAY_OF_YEAR
     st = 'day_of_year'
 
 class Hours(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.HOURS
     st = 'hours'
 
 class Minutes(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.MINUTES
     st = 'minutes'
 
 class Seconds(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.SECONDS
     st = 'seconds'
 
 class Time(RqlTopLevelQuery):
+    __slots__ = ()
     tt = p.Term.TIME
     st = 'time'
 
 class ISO8601(RqlTopLevelQuery):
+    __slots__ = ()
     tt = p.Term.ISO8601
     st = 'iso8601'
 
 class EpochTime(RqlTopLevelQuery):
+    __slots__ = ()
     tt = p.Term.EPOCH_TIME
     st = 'epoch_time'
 
 class Now(RqlTopLevelQuery):
+    __slots__ = ()
     tt = p.Term.NOW
     st = 'now'
 
 class InTimezone(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.IN_TIMEZONE
     st = 'in_timezone'
 
 class ToEpochTime(RqlMethodQuery):
+    __slots__ = ()
     tt = p.Term.TO_EPOCH_TIME
     st = 'to_epoch_time'
 
@@ -1253,55 +1585,52 @@ class ToEpochTime(RqlMethodQuery):
 def func_wrap(val):
     val = expr(val)
 
-    # Scan for IMPLICIT_VAR or JS
-    def ivar_scan(node):
-        if not isinstance(node, RqlQuery):
-            return False
-
-        if isinstance(node, ImplicitVar):
-            return True
-        if any([ivar_scan(arg) for arg in node.args]):
-            return True
-        if any([ivar_scan(arg) for k,arg in node.optargs.items()]):
-            return True
-        return False
-
-    if ivar_scan(val):
+    if val.has_ivar:
         return Func(lambda x: val)
 
     return val
 
+# The first var id free for the lambdas being built in this thread
+_func_scope = local()
+
+# The vars of a lambda are numbered by their position, after the vars of the
+# lambdas it's built in. Lambdas that aren't nested in each other can use the
+# same ids since the server only keeps the vars a lambda uses from outside,
+# so a query always gets the same ids, and serializes to the same bytes.
 class Func(RqlQuery):
+    __slots__ = ('vrs',)
     tt = p.Term.FUNC
-    lock = Lock()
-    nextVarId = 1
 
     def __init__(self, lmbd):
-        vrs = []
-        vrids = []
-        for i in range(lmbd.func_code.co_argcount):
-            Func.lock.acquire()
-            var_id = Func.nextVarId
-            Func.nextVarId += 1
-            Func.lock.release()
-            vrs.append(Var(var_id))
-            vrids.append(var_id)
+        first_var_id = getattr(_func_scope, 'next_var_id', 1)
+        vrids = range(first_var_id, first_var_id + lmbd.func_code.co_argcount)
+        vrs = [Var(var_id) for var_id in vrids]
+
+        _func_scope.next_var_id = first_var_id + len(vrids)
+        try:
+            body = expr(lmbd(*vrs))
+        finally:
+            _func_scope.next_var_id = first_var_id
 
         self.vrs = vrs
-        self.args = [MakeArray(*vrids), expr(lmbd(*vrs))]
-        self.optargs = {}
+        self.args = (MakeArray(*vrids), body)
+        self.optargs = _no_optargs
+        self.has_ivar = self.args[1].has_ivar
 
     def compose(self, args, optargs):
             return T('lambda ', T(*[v.compose([v.args[0].compose(None, None)], []) for v in self.vrs], intsp=', '), ': ', args[1])
 
 class Asc(RqlTopLevelQuery):
+    __slots__ = ()
     tt = p.Term.ASC
     st = 'asc'
 
 class Desc(RqlTopLevelQuery):
+    __slots__ = ()
     tt = p.Term.DESC
     st = 'desc'
 
 class Literal(RqlTopLevelQuery):
+    __slots__ = ()
     tt = p.Term.LITERAL
     st = 'literal'
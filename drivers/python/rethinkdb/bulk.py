@@ -0,0 +1,198 @@
+# Copyright 2010-2013 RethinkDB, all rights reserved.
+
+__all__ = ['BulkWriter']
+
+import json
+import time
+import threading
+
+from rethinkdb.net import MultiplexedConnection
+from rethinkdb.ast import RqlQuery, Json, MakeArray, expr
+from rethinkdb.query import table as r_table
+from rethinkdb.errors import RqlError, RqlDriverError
+
+# Collects documents written from any number of threads and inserts them into
+# a table in batches. A batch is sent once it holds `batch_size` documents or
+# about `batch_bytes` of JSON, or once it's `flush_interval` seconds old.
+#
+# On a multiplexed connection batches are sent as asynchronous queries and at
+# most `max_in_flight` are outstanding at a time. The errors of each batch are
+# kept until the next checkpoint. A thread of the writer sends the batches
+# that get too old.
+#
+# Other connections aren't safe to use from several threads, so the writer
+# only uses them from the threads that call it: a batch that got too old is
+# sent by the next write, or by `flush`, `checkpoint` or `close`. Batches are
+# sent with noreply and a `noreply_wait` is done after every `max_in_flight`
+# of them. The server doesn't report the errors of those, write errors are
+# only returned on multiplexed connections.
+class BulkWriter(object):
+    def __init__(self, conn, table, batch_size=1000, batch_bytes=1024 * 1024, flush_interval=1.0,
+                 max_in_flight=4, durability=(), upsert=()):
+        if batch_size < 1:
+            raise RqlDriverError("BulkWriter batch_size must be at least 1.")
+        if max_in_flight < 1:
+            raise RqlDriverError("BulkWriter max_in_flight must be at least 1.")
+
+        self.conn = conn
+        self.table = table if isinstance(table, RqlQuery) else r_table(table)
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        self.max_in_flight = max_in_flight
+        self.durability = durability
+        self.upsert = upsert
+        self.closed = False
+
+        self._cond = threading.Condition(threading.Lock())
+        self._batch = [ ]
+        self._batch_bytes = 0
+        self._batch_time = None
+
+        # Sending is serialized so that a connection that isn't multiplexed is
+        # only used by one thread at a time
+        self._send_lock = threading.Lock()
+        self._async = isinstance(conn, MultiplexedConnection)
+        self._in_flight = [ ]
+        self._unacknowledged = 0
+        self._errors = [ ]
+
+        self._flusher = None
+        if flush_interval is not None and self._async:
+            self._flusher = threading.Thread(target=self._flush_loop)
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    # Adds a document to the current batch, sending the batch if it's full
+    def write(self, doc):
+        try:
+            # Documents are serialized once, the batch is sent as a JSON array
+            doc = json.dumps(doc)
+            size = len(doc)
+        except (TypeError, ValueError):
+            # Times and other values that need a query of their own
+            doc = expr(doc)
+            size = 0
+
+        with self._cond:
+            if self.closed:
+                raise RqlDriverError("BulkWriter is closed.")
+            if not self._batch:
+                self._batch_time = time.time()
+            self._batch.append(doc)
+            self._batch_bytes += size
+            if len(self._batch) < self.batch_size and \
+               (self.batch_bytes is None or self._batch_bytes < self.batch_bytes) and \
+               not self._batch_expired():
+                return
+            batch = self._take_batch()
+        self._send(batch)
+
+    # Must be called with the lock held
+    def _take_batch(self):
+        batch = self._batch
+        self._batch = [ ]
+        self._batch_bytes = 0
+        self._batch_time = None
+        return batch
+
+    # Without a flusher thread, a batch that got too old is sent by the next
+    # write. Must be called with the lock held.
+    def _batch_expired(self):
+        return self._flusher is None and self.flush_interval is not None and \
+               time.time() - self._batch_time >= self.flush_interval
+
+    def _flush_loop(self):
+        with self._cond:
+            while not self.closed:
+                if self._batch_time is None:
+                    self._cond.wait(self.flush_interval)
+                    continue
+                remaining = self._batch_time + self.flush_interval - time.time()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                batch = self._take_batch()
+                self._cond.release()
+                try:
+                    self._send(batch)
+                except Exception as err:
+                    with self._send_lock:
+                        self._errors.append((batch, err))
+                finally:
+                    self._cond.acquire()
+
+    def _insert_query(self, batch):
+        if all(isinstance(doc, str) for doc in batch):
+            records = Json('[' + ','.join(batch) + ']')
+        else:
+            records = MakeArray(*[Json(doc) if isinstance(doc, str) else doc for doc in batch])
+        return self.table.insert(records, durability=self.durability, upsert=self.upsert)
+
+    def _send(self, batch):
+        if not batch:
+            return
+        query = self._insert_query(batch)
+        with self._send_lock:
+            if self._async:
+                while len(self._in_flight) >= self.max_in_flight:
+                    self._wait_for_batch(*self._in_flight.pop(0))
+                self._in_flight.append((batch, query.run_async(self.conn)))
+            else:
+                if self._unacknowledged >= self.max_in_flight:
+                    self.conn.noreply_wait()
+                    self._unacknowledged = 0
+                query.run(self.conn, noreply=True)
+                self._unacknowledged += 1
+
+    def _wait_for_batch(self, batch, future):
+        try:
+            result = future.result()
+        except (RqlError, RqlDriverError) as err:
+            self._errors.append((batch, err))
+            return
+        if result.get('errors'):
+            self._errors.append((batch, result))
+
+    # Sends the current batch, even if it's not full
+    def flush(self):
+        with self._cond:
+            batch = self._take_batch()
+        self._send(batch)
+
+    # Sends the current batch and waits until the server has written every
+    # batch sent so far. Returns the (documents, error) pairs of the batches
+    # that failed since the last checkpoint, where the error is the exception
+    # raised by the insert or its result if some of the documents were
+    # rejected. Documents are returned as they were serialized. Only batches
+    # sent on a multiplexed connection report their errors.
+    def checkpoint(self):
+        self.flush()
+        with self._send_lock:
+            if self._async:
+                while self._in_flight:
+                    self._wait_for_batch(*self._in_flight.pop(0))
+            else:
+                self.conn.noreply_wait()
+                self._unacknowledged = 0
+            errors = self._errors
+            self._errors = [ ]
+        return errors
+
+    # Writes the remaining documents and stops the writer, returns the errors
+    # like `checkpoint`.
+    def close(self):
+        with self._cond:
+            if self.closed:
+                return [ ]
+            self.closed = True
+            self._cond.notify_all()
+        if self._flusher is not None:
+            self._flusher.join()
+        return self.checkpoint()
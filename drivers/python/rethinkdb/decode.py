@@ -0,0 +1,98 @@
+# Copyright 2010-2013 RethinkDB, all rights reserved.
+
+# Reads the common shape of responses straight from the wire format: a type, a
+# token and R_JSON datums, which is all the server sends to queries that accept
+# R_JSON unless there's a backtrace or a profile. Other responses are left to
+# the protobuf library.
+
+__all__ = ['decode_response', 'JsonResponse', 'JsonDatum']
+
+from rethinkdb import ql2_enums as p
+
+_response_type_key = 0x08
+_response_token_key = 0x10
+_response_datum_key = 0x1a
+_datum_type_key = 0x08
+_datum_r_str_key = 0x22
+_r_json = p.Datum.R_JSON
+
+# Stands in for a `Datum` of type R_JSON
+class JsonDatum(object):
+    __slots__ = ['r_str']
+    type = _r_json
+
+    def __init__(self, r_str):
+        self.r_str = r_str
+
+# Stands in for the empty `Backtrace` of a response, shared by all of them
+class _NoBacktrace(object):
+    __slots__ = []
+    frames = ()
+
+# Stands in for a `Response` without a backtrace or a profile. The backtrace
+# is empty like in a parsed message, the profile is None so that it can be
+# skipped without decoding it.
+class JsonResponse(object):
+    __slots__ = ['type', 'token', 'response']
+    backtrace = _NoBacktrace()
+    profile = None
+
+    def __init__(self, type, token, response):
+        self.type = type
+        self.token = token
+        self.response = response
+
+# Returns the varint at `pos` of the buffer and the position after it
+def _read_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+# Decodes the serialized response in `buf[start:end]`, where `buf` is a
+# bytearray. Returns None if the response has anything other than a type, a
+# token and R_JSON datums, or isn't laid out the way the server writes it.
+def decode_response(buf, start, end):
+    response_type = None
+    token = 0
+    datums = [ ]
+    pos = start
+    try:
+        while pos < end:
+            key = buf[pos]
+            if key == _response_datum_key:
+                length = buf[pos + 1]
+                if length < 0x80:
+                    pos += 2
+                else:
+                    length, pos = _read_varint(buf, pos + 1)
+                datum_end = pos + length
+
+                # The datum is its type followed by its string
+                if buf[pos] != _datum_type_key or buf[pos + 1] != _r_json or buf[pos + 2] != _datum_r_str_key:
+                    return None
+                length = buf[pos + 3]
+                if length < 0x80:
+                    pos += 4
+                else:
+                    length, pos = _read_varint(buf, pos + 3)
+                if pos + length != datum_end:
+                    return None
+                datums.append(JsonDatum(buf[pos:datum_end].decode('utf-8')))
+                pos = datum_end
+            elif key == _response_type_key:
+                response_type, pos = _read_varint(buf, pos + 1)
+            elif key == _response_token_key:
+                token, pos = _read_varint(buf, pos + 1)
+            else:
+                return None
+    except (IndexError, UnicodeDecodeError):
+        return None
+    if response_type is None or pos != end:
+        return None
+    return JsonResponse(response_type, token, datums)
@@ -0,0 +1,117 @@
+# Copyright 2010-2013 RethinkDB, all rights reserved.
+
+# Writes the protobuf wire format of terms and START queries directly, without
+# building protobuf messages. The output is the same as the protobuf
+# library's, which is still used for terms that define their own `build`.
+
+__all__ = ['encode_term', 'encode_start']
+
+import numbers
+import struct
+import types
+
+from rethinkdb import ql2_enums as p
+from rethinkdb.ast import RqlQuery, Datum
+from rethinkdb.errors import RqlDriverError
+
+# Protobuf keys of the fields written here, see ql2.proto
+_query_type_key = '\x08'
+_query_term_key = '\x12'
+_query_token_key = '\x18'
+_query_accepts_r_json_key = '\x28'
+_query_optargs_key = '\x32'
+_term_type_key = '\x08'
+_term_datum_key = '\x12'
+_term_args_key = '\x1a'
+_term_optargs_key = '\x22'
+_pair_key_key = '\x0a'
+_pair_val_key = '\x12'
+
+def _varint(value):
+    out = [ ]
+    while value > 0x7f:
+        out.append(chr(0x80 | (value & 0x7f)))
+        value >>= 7
+    out.append(chr(value))
+    return ''.join(out)
+
+_small_varints = [chr(i) for i in xrange(0x80)]
+
+def _field(key, data):
+    length = len(data)
+    if length < 0x80:
+        return key + _small_varints[length] + data
+    return key + _varint(length) + data
+
+_null_term = _term_type_key + chr(p.Term.DATUM) + _field(_term_datum_key, '\x08' + chr(p.Datum.R_NULL))
+_true_term = _term_type_key + chr(p.Term.DATUM) + _field(_term_datum_key, '\x08' + chr(p.Datum.R_BOOL) + '\x10\x01')
+_false_term = _term_type_key + chr(p.Term.DATUM) + _field(_term_datum_key, '\x08' + chr(p.Datum.R_BOOL) + '\x10\x00')
+_num_prefix = _term_type_key + chr(p.Term.DATUM) + _term_datum_key + '\x0b\x08' + chr(p.Datum.R_NUM) + '\x19'
+_str_prefix = _term_type_key + chr(p.Term.DATUM)
+_str_datum_prefix = '\x08' + chr(p.Datum.R_STR) + '\x22'
+
+# Serializes a value as a DATUM term the same way `Datum.build` does
+def _encode_datum(value):
+    value_type = type(value)
+    if value_type is float or value_type is int:
+        return _num_prefix + struct.pack('<d', value)
+    elif value_type is str:
+        return _str_prefix + _field(_term_datum_key, _field(_str_datum_prefix, value))
+    elif value_type is unicode:
+        return _str_prefix + _field(_term_datum_key, _field(_str_datum_prefix, value.encode('utf-8')))
+    elif value is None:
+        return _null_term
+    elif isinstance(value, bool):
+        return _true_term if value else _false_term
+    elif isinstance(value, numbers.Real):
+        return _num_prefix + struct.pack('<d', value)
+    elif isinstance(value, types.StringTypes):
+        return _encode_datum(unicode(value) if isinstance(value, unicode) else str(value))
+    raise RqlDriverError("Cannot build a query from a %s" % type(value).__name__)
+
+_type_fields = { }
+
+def _type_field(tt):
+    if tt not in _type_fields:
+        _type_fields[tt] = _term_type_key + _varint(tt)
+    return _type_fields[tt]
+
+_default_build = RqlQuery.build.im_func
+_datum_build = Datum.build.im_func
+
+# Returns the serialized `Term` message for a term
+def encode_term(term):
+    build = type(term).build.im_func
+    if build is _default_build:
+        tt = term.tt
+        parts = [_type_fields[tt] if tt in _type_fields else _type_field(tt)]
+        for arg in term.args:
+            parts.append(_field(_term_args_key, encode_term(arg)))
+        for k, v in term.optargs.iteritems():
+            if isinstance(k, unicode):
+                k = k.encode('utf-8')
+            parts.append(_field(_term_optargs_key, _field(_pair_key_key, k) + _field(_pair_val_key, encode_term(v))))
+        return ''.join(parts)
+    elif build is _datum_build:
+        return _encode_datum(term.data)
+
+    # Terms that build themselves go through protobuf
+    from rethinkdb import ql2_pb2
+    pb_term = ql2_pb2.Term()
+    term.build(pb_term)
+    return pb_term.SerializeToString()
+
+# Returns the serialized START `Query` message for a token, a list of global
+# optarg (key, term) pairs, and the serialized term. Fields are written in
+# order of field number like the protobuf library does.
+def encode_start(token, global_optargs, serialized_term, accepts_r_json=False):
+    parts = [_query_type_key + _varint(p.Query.START),
+             _field(_query_term_key, serialized_term),
+             _query_token_key + _varint(token)]
+    if accepts_r_json:
+        parts.append(_query_accepts_r_json_key + '\x01')
+    for k, v in global_optargs:
+        if isinstance(k, unicode):
+            k = k.encode('utf-8')
+        parts.append(_field(_query_optargs_key, _field(_pair_key_key, k) + _field(_pair_val_key, encode_term(v))))
+    return ''.join(parts)
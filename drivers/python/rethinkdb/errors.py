@@ -1,4 +1,4 @@
-from . import ql2_pb2 as p
+from . import ql2_enums as p
 
 class RqlError(Exception):
     def __init__(self, message, term, frames):
@@ -29,6 +29,10 @@ class RqlDriverError(Exception):
     def __str__(self):
         return self.message
 
+# Raised when the response to a query doesn't come in before its timeout
+class RqlTimeoutError(RqlDriverError):
+    pass
+
 class QueryPrinter(object):
     def __init__(self, root, frames=[]):
         self.root = root
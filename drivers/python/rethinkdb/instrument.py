@@ -0,0 +1,70 @@
+# Copyright 2010-2013 RethinkDB, all rights reserved.
+
+__all__ = ['QueryStats', 'SlowQueryLog']
+
+import logging
+import random
+import time
+
+from rethinkdb.errors import QueryPrinter
+
+# Where the time of a query went, collected for the query hooks of a
+# connection. Times are in seconds:
+#
+#   build_time        encoding the term and the run options of the query
+#   serialize_time    serializing the query, and its CONTINUE and STOP queries
+#   first_byte_time   from writing the query to reading the first response
+#                     header, that is the network and the server
+#   parse_time        parsing the responses
+#   deconstruct_time  decoding the rows of the responses
+#   total_time        from building the query until it's done
+#
+# A query is done when its result is returned or, for a cursor, once the
+# cursor is read to the end, closed or garbage-collected. `batches` counts
+# every response, including the one to a STOP, and the byte counts include
+# the length prefixes. `error` is set if the query failed.
+class QueryStats(object):
+    def __init__(self, term):
+        self.term = term
+        self.token = None
+        self.start_time = time.time()
+        self.sent_time = None
+        self.build_time = 0.0
+        self.serialize_time = 0.0
+        self.first_byte_time = None
+        self.parse_time = 0.0
+        self.deconstruct_time = 0.0
+        self.total_time = None
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.batches = 0
+        self.error = None
+
+    def __str__(self):
+        def ms(seconds):
+            return '-' if seconds is None else '%.3fms' % (seconds * 1000)
+        return "total %s, build %s, serialize %s, first byte %s, parse %s, deconstruct %s, " \
+               "%d bytes out, %d bytes in, %d batches" % \
+               (ms(self.total_time), ms(self.build_time), ms(self.serialize_time), ms(self.first_byte_time),
+                ms(self.parse_time), ms(self.deconstruct_time), self.bytes_out, self.bytes_in, self.batches)
+
+# A query hook that logs the queries that took at least `threshold` seconds
+# along with their stats. Only a `sample_rate` fraction of the slow queries is
+# logged, and the query is only printed for those.
+#
+#   conn.add_query_hook(r.SlowQueryLog(threshold=0.5, sample_rate=0.1))
+class SlowQueryLog(object):
+    def __init__(self, threshold=1.0, sample_rate=1.0, logger=None):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.logger = logger if logger is not None else logging.getLogger('rethinkdb.slow_queries')
+        self.slow_queries = 0
+
+    def __call__(self, stats):
+        if stats.total_time < self.threshold:
+            return
+        self.slow_queries += 1
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        self.logger.warning("Slow query (%s%s): %s", stats,
+                            '' if stats.error is None else ', failed', QueryPrinter(stats.term).print_query())
@@ -1,10 +1,18 @@
 # Copyright 2010-2012 RethinkDB, all rights reserved.
 
-__all__ = ['connect', 'Connection', 'Cursor', 'protobuf_implementation']
+__all__ = ['connect', 'Connection', 'MultiplexedConnection', 'Cursor', 'QueryFuture', 'protobuf_implementation']
 
+import array
+import collections
 import errno
+import json
+import logging
+import math
 import socket
 import struct
+import threading
+import time
+import weakref
 from os import environ
 
 try:
@@ -13,19 +21,148 @@ try:
 except ImportError:
     protobuf_implementation = 'python'
 
-from rethinkdb import ql2_pb2 as p
+from rethinkdb import ql2_enums as p
 
 from rethinkdb import repl # For the repl connection
 from rethinkdb.errors import *
-from rethinkdb.ast import Datum, DB, expr
+from rethinkdb.ast import Datum, DB, expr, lazy_deconstruct, deconstruct_batch
+from rethinkdb.prepared import BoundQuery
+from rethinkdb.encode import encode_term, encode_start
+from rethinkdb.decode import decode_response
+from rethinkdb.instrument import QueryStats
+
+# Older protobuf backends, including the C++ one, only parse from a string
+def _memoryview_parser_supported(pb):
+    response = pb.Response()
+    response.type = p.Response.SUCCESS_ATOM
+    response.token = 1
+    datum = response.response.add()
+    datum.type = p.Datum.R_JSON
+    datum.r_str = "null"
+    try:
+        parsed = pb.Response()
+        parsed.ParseFromString(memoryview(response.SerializeToString()))
+        return parsed == response
+    except Exception:
+        return False
+
+_pb = None
+_parseable = None
+
+# Returns the protobuf messages of ql2.proto. They're loaded the first time
+# a query needs one, as loading them takes a while and most queries are
+# serialized without them.
+def _protobuf():
+    global _pb, _parseable
+    if _pb is None:
+        from rethinkdb import ql2_pb2
+        if _memoryview_parser_supported(ql2_pb2):
+            _parseable = lambda view: view
+        else:
+            _parseable = lambda view: view.tobytes()
+        _pb = ql2_pb2
+    return _pb
+
+# Run options that only affect the driver and are not sent to the server
+driver_opt_args = frozenset(['prefetch', 'prefetch_bytes', 'adaptive_prefetch',
+                             'max_batch_rows', 'max_batch_bytes', 'max_batch_seconds',
+                             'result_format', 'timeout'])
+
+# Run options that are sent to the server as fields of the batch_conf optarg
+batch_conf_opt_args = {
+    'max_batch_rows': 'max_els',
+    'max_batch_bytes': 'max_size',
+    'max_batch_seconds': 'max_dur'
+}
+
+# Weight given to the latest sample in the adaptive prefetch measurements
+_adaptive_weight = 0.3
+
+def _moving_average(average, sample):
+    if average is None:
+        return sample
+    return average + _adaptive_weight * (sample - average)
+
+# Returns the datum as a JSON string, as it was received if possible
+def _datum_json(datum, time_format='native'):
+    if datum.type == p.Datum.R_JSON:
+        return datum.r_str
+    return json.dumps(Datum.deconstruct(datum, 'raw'))
+
+# How results are decoded for each value of the result_format run option
+result_formats = {
+    'native': Datum.deconstruct,
+    'raw_json': _datum_json,
+    'lazy': lazy_deconstruct
+}
+
+def _result_decoder(opts):
+    return result_formats[opts.get('result_format', 'native')]
+
+# Returns a function that decodes the datums of a batch, all at once for the
+# native result format
+def _batch_decoder(opts):
+    deconstruct = _result_decoder(opts)
+    if deconstruct is Datum.deconstruct:
+        return deconstruct_batch
+    return lambda datums, time_format: [deconstruct(datum, time_format) for datum in datums]
+
+# When to give up waiting for a response to a query with the timeout run option
+def _deadline(opts):
+    if 'timeout' in opts and opts['timeout'] is not None:
+        return time.time() + opts['timeout']
+    return None
+
+def _response_size(response):
+    return sum(len(datum.r_str) for datum in response.response)
+
+# Queries are serialized by `rethinkdb.encode` unless this is set to False,
+# in which case their terms are built with the protobuf library
+direct_encoding = True
+
+def _protobuf_parses_in_python():
+    try:
+        from google.protobuf.internal import api_implementation
+        return api_implementation.Type() == 'python'
+    except ImportError:
+        return protobuf_implementation == 'python'
+
+# Responses that only hold R_JSON datums are read by `rethinkdb.decode` while
+# this is set, otherwise protobuf parses all of them. The direct decoder is
+# only faster than the pure Python protobuf backend.
+direct_decoding = _protobuf_parses_in_python()
+
+# A START query whose term is already serialized, either by the direct encoder
+# or ahead of time by a prepared query. It's serialized without protobuf.
+class EncodedStart(object):
+    type = p.Query.START
+
+    def __init__(self, token, global_optargs, serialized_term):
+        self.token = token
+        self.global_optargs = global_optargs
+        self.serialized_term = serialized_term
+        self.accepts_r_json = False
+
+    def SerializeToString(self):
+        return encode_start(self.token, self.global_optargs, self.serialized_term, self.accepts_r_json)
 
 class Cursor(object):
+    # Default limit on how much data may be buffered before the cursor
+    # stops asking for more batches ahead of time
+    default_prefetch_bytes = 16 * 1024 * 1024
+
+    # Largest window an adaptive cursor grows to when no prefetch is given
+    default_max_prefetch = 8
+
     def __init__(self, conn, query, term, opts):
         self.conn = conn
         self.query = query
         self.term = term
         self.opts = opts
         self.responses = [ ]
+        self.response_sizes = [ ]
+        self.buffered_bytes = 0
+        self.largest_batch_bytes = 0
         self.outstanding_requests = 0
         self.end_flag = False
 
@@ -33,39 +170,233 @@ class Cursor(object):
         if 'time_format' in self.opts:
             self.time_format = self.opts['time_format']
 
+        # Batches are decoded with this, depending on the result_format
+        self.deconstruct_batch = _batch_decoder(self.opts)
+
+        # The number of batches to request ahead of the one being read
+        self.prefetch = 1
+        if 'prefetch' in self.opts:
+            self.prefetch = self.opts['prefetch']
+
+        self.prefetch_bytes = Cursor.default_prefetch_bytes
+        if 'prefetch_bytes' in self.opts:
+            self.prefetch_bytes = self.opts['prefetch_bytes']
+
+        # The batch limits the server was asked to use, if any
+        self.batch_conf = self.opts.get('batch_conf')
+
+        # In adaptive mode the cursor starts with a single batch in flight and
+        # sizes the window to cover the round trip time at the rate the
+        # consumer reads batches, up to `max_prefetch`.
+        self.adaptive = self.opts.get('adaptive_prefetch', False)
+        self.max_prefetch = self.prefetch
+        if self.adaptive:
+            if 'prefetch' not in self.opts:
+                self.max_prefetch = Cursor.default_max_prefetch
+            self.prefetch = 1
+        self.rtt = None
+        self.drain_time = None
+        self._continue_times = [ ]
+        self._head_time = None
+
+        # Set by the connection when it has query hooks
+        self.stats = None
+
+    def _continue_sent(self):
+        self.outstanding_requests += 1
+        if self.adaptive:
+            self._continue_times.append(time.time())
+
     def _extend(self, response):
+        if self.end_flag:
+            # The stream already ended or the cursor was closed, this answers
+            # a CONTINUE that was still in flight at the time
+            return
+
+        if self.adaptive:
+            now = time.time()
+            if self._continue_times:
+                self.rtt = _moving_average(self.rtt, now - self._continue_times.pop(0))
+            if len(self.responses) == 0:
+                self._head_time = now
+            self._adapt()
+
         self.end_flag = response.type != p.Response.SUCCESS_PARTIAL
+        size = _response_size(response)
         self.responses.append(response)
-
-        if len(self.responses) == 1 and not self.end_flag:
-            self.conn._async_continue_cursor(self)
+        self.response_sizes.append(size)
+        self.buffered_bytes += size
+        self.largest_batch_bytes = max(self.largest_batch_bytes, size)
+
+    def _pop_response(self):
+        return self.conn._pop_cursor_response(self)
+
+    # Called by the connection, under its lock if it has one, since a reader
+    # thread may be extending the cursor at the same time
+    def _take_response(self):
+        response = self.responses.pop(0)
+        self.buffered_bytes -= self.response_sizes.pop(0)
+
+        if self.adaptive:
+            # Time the consumer spent on the batch once it was available
+            now = time.time()
+            if self._head_time is not None:
+                self.drain_time = _moving_average(self.drain_time, now - self._head_time)
+            self._head_time = now if len(self.responses) > 0 else None
+            self._adapt()
+
+        return response
+
+    # Enough batches have to be in flight to keep the consumer busy for one
+    # round trip
+    def _adapt(self):
+        if self.rtt is None or self.drain_time is None:
+            return
+        window = int(math.ceil(self.rtt / max(self.drain_time, 1e-6)))
+        self.prefetch = max(1, min(window, self.max_prefetch))
+
+    # Keeps up to `prefetch` CONTINUEs outstanding, as long as that doesn't
+    # put more than `prefetch` batches ahead of the one being read or more
+    # than `prefetch_bytes` in the buffer. Batches in flight are assumed to be
+    # as large as the largest one so far.
+    def _should_prefetch(self):
+        return not self.end_flag and \
+            self.outstanding_requests < self.prefetch and \
+            self.outstanding_requests + len(self.responses) <= self.prefetch and \
+            self.buffered_bytes + self.outstanding_requests * self.largest_batch_bytes < self.prefetch_bytes
 
     def __iter__(self):
-        time_format = self.time_format
-        deconstruct = Datum.deconstruct
         while True:
             if len(self.responses) == 0 and not self.end_flag:
                 self.conn._continue_cursor(self)
-            if len(self.responses) == 1 and not self.end_flag:
-                self.conn._async_continue_cursor(self)
 
             if len(self.responses) == 0 and self.end_flag:
+                self._record_end()
+                break
+
+            # Batches are decoded as a whole, which also keeps the consumer's
+            # time out of the decoding time in the stats
+            for row in self._decode_response(self.responses[0]):
+                yield row
+            self._pop_response()
+
+    # Yields the rows of each batch as a list, as the batches arrive. The batch
+    # is out of the buffer by the time it's yielded.
+    def batches(self):
+        while True:
+            if len(self.responses) == 0 and not self.end_flag:
+                self.conn._continue_cursor(self)
+
+            if len(self.responses) == 0 and self.end_flag:
+                self._record_end()
                 break
 
-            self.conn._check_error_response(self.responses[0], self.term)
-            if self.responses[0].type != p.Response.SUCCESS_PARTIAL and self.responses[0].type != p.Response.SUCCESS_SEQUENCE:
-                raise RqlDriverError("Unexpected response type received for cursor")
+            yield self._decode_response(self._pop_response())
+
+    def _check_response(self, response):
+        try:
+            self.conn._check_error_response(response, self.term)
+        except RqlError as err:
+            self._record_end(err)
+            raise
+        if response.type != p.Response.SUCCESS_PARTIAL and response.type != p.Response.SUCCESS_SEQUENCE:
+            raise RqlDriverError("Unexpected response type received for cursor")
+
+    def _decode_response(self, response):
+        self._check_response(response)
+        if self.stats is None:
+            return self.deconstruct_batch(response.response, self.time_format)
+        start = time.time()
+        rows = self.deconstruct_batch(response.response, self.time_format)
+        self.stats.deconstruct_time += time.time() - start
+        return rows
+
+    # Reports the cursor's stats to the query hooks, once
+    def _record_end(self, error=None):
+        stats = self.stats
+        if stats is not None:
+            self.stats = None
+            self.conn._finish_stats(stats, error)
+
+    # Reads the rest of the cursor into a column for each of the given fields
+    # and returns the columns and masks as two dicts keyed by field. Columns
+    # are `array.array`s of the type given in `dtypes`, either a type code for
+    # all of the fields or a dict of type codes by field, or lists for the 'O'
+    # type code. A mask holds 1 for the rows where the field was missing or
+    # null, those rows hold 0 (or None) in the column. The arrays are turned
+    # into NumPy arrays without copying if `use_numpy` is set, or by default
+    # if NumPy can be imported.
+    def to_columns(self, fields, dtypes='d', use_numpy=None):
+        numpy = None
+        if use_numpy is None or use_numpy:
+            try:
+                import numpy
+            except ImportError:
+                if use_numpy:
+                    raise RqlDriverError("NumPy is not available.")
+
+        if isinstance(dtypes, dict):
+            dtypes = dict((field, dtypes.get(field, 'd')) for field in fields)
+        else:
+            dtypes = dict((field, dtypes) for field in fields)
 
-            for datum in self.responses[0].response:
-                yield deconstruct(datum, time_format)
-            del self.responses[0]
+        columns = [ ]
+        masks = [ ]
+        for field in fields:
+            if dtypes[field] == 'O':
+                columns.append([ ])
+            else:
+                columns.append(array.array(dtypes[field]))
+            masks.append(array.array('b'))
+
+        for row in self:
+            if not isinstance(row, collections.Mapping):
+                raise RqlDriverError("Cursor.to_columns requires rows that are objects.")
+            for field, column, mask in zip(fields, columns, masks):
+                value = row.get(field)
+                if value is None:
+                    column.append(0 if isinstance(column, array.array) else None)
+                    mask.append(1)
+                    continue
+                try:
+                    column.append(value)
+                except (TypeError, OverflowError):
+                    raise RqlDriverError("Cannot store %r in the column of type '%s' for field %s." % (value, dtypes[field], field))
+                mask.append(0)
+
+        if numpy is not None:
+            columns = [numpy.array(column, dtype=object) if isinstance(column, list) else
+                       numpy.frombuffer(column, dtype=column.typecode) for column in columns]
+            masks = [numpy.frombuffer(mask, dtype=bool) for mask in masks]
+        return dict(zip(fields, columns)), dict(zip(fields, masks))
+
+    # Returns a future for the rows of the next batch, or for None once the
+    # cursor is exhausted. Only available on multiplexed connections.
+    def next_batch_async(self):
+        return self.conn._next_batch_async(self)
 
     def close(self):
         if not self.end_flag:
             self.end_flag = True
             self.conn._end_cursor(self)
+        self._record_end()
+
+    # Only available on multiplexed connections, the connection marks the
+    # cursor as ended once it's sure it can stop it
+    def close_async(self):
+        if not self.end_flag:
+            future = self.conn._end_cursor_async(self)
+        else:
+            future = QueryFuture(self.conn)
+            future._set_result(None)
+        self._record_end()
+        return future
 
 class Connection(object):
+    # Initial size of the buffer responses are read into, it grows to fit
+    # the largest response that has to be held at once
+    recv_buffer_size = 64 * 1024
+
     def __init__(self, host, port, db, auth_key, timeout):
         self.socket = None
         self.host = host
@@ -75,6 +406,15 @@ class Connection(object):
         self.timeout = timeout
         self.cursor_cache = { }
 
+        # Callables that are given the `QueryStats` of every query once it's
+        # done, see `add_query_hook`
+        self.query_hooks = [ ]
+        self._query_stats = { }
+        self._cursor_refs = set()
+
+        # Tokens of the queries that timed out before their response came in
+        self._abandoned = set()
+
         # Try to convert the port to an integer
         try:
           self.port = int(port)
@@ -104,12 +444,15 @@ class Connection(object):
         self._sock_sendall(struct.pack("<L", len(self.auth_key)) + str.encode(self.auth_key, 'ascii'))
 
         # Read out the response from the server, which will be a null-terminated string
-        response = b""
+        self._reset_buffer()
         while True:
-            char = self._sock_recv(1)
-            if char == b"\0":
+            null_pos = self._buf.find(b"\0", self._buf_start, self._buf_end)
+            if null_pos != -1:
                 break
-            response += char
+            if not self._fill_buffer(self._buf_end - self._buf_start + 1):
+                raise RqlDriverError("Connection is closed.")
+        response = bytes(self._buf[self._buf_start:null_pos])
+        self._buf_start = null_pos + 1
 
         if response != b"SUCCESS":
             self.close(noreply_wait=False)
@@ -131,19 +474,52 @@ class Connection(object):
             self.socket.close()
             self.socket = None
         self.cursor_cache = { }
+        self._query_stats = { }
+        self._abandoned = set()
 
     def noreply_wait(self):
-        token = self.next_token
-        self.next_token += 1
+        token = self._new_token()
 
         # Construct query
-        query = p.Query()
+        query = _protobuf().Query()
         query.type = p.Query.NOREPLY_WAIT
         query.token = token
 
         # Send the request
         return self._send_query(query, 'noreply_wait')
 
+    # Adds a callable that is given the `QueryStats` of each query run on this
+    # connection once the query is done. Hooks are called on the thread that
+    # finishes the query, the connection's reader thread for queries run
+    # asynchronously on a multiplexed connection, so they should be quick.
+    # Exceptions raised by a hook are logged to the 'rethinkdb' logger.
+    def add_query_hook(self, hook):
+        self.query_hooks = self.query_hooks + [hook]
+
+    def remove_query_hook(self, hook):
+        self.query_hooks = [h for h in self.query_hooks if h != hook]
+
+    def _finish_stats(self, stats, error=None):
+        self._query_stats.pop(stats.token, None)
+        stats.error = error
+        stats.total_time = time.time() - stats.start_time
+        for hook in self.query_hooks:
+            try:
+                hook(stats)
+            except Exception:
+                # A failing hook shouldn't fail the query
+                logging.getLogger('rethinkdb').exception("Query hook %r failed.", hook)
+
+    # Finishes the stats of a cursor that's garbage-collected before it's read
+    # to the end or closed. The connection holds the weak reference, so that
+    # its callback still runs once the cursor is gone.
+    def _watch_cursor(self, cursor, stats):
+        def collected(ref):
+            self._cursor_refs.discard(ref)
+            if stats.total_time is None:
+                self._finish_stats(stats)
+        self._cursor_refs.add(weakref.ref(cursor, collected))
+
     # Not thread safe. Sets this connection as global state that will be used
     # by subsequence calls to `query.run`. Useful for trying out RethinkDB in
     # a Python repl environment.
@@ -151,10 +527,10 @@ class Connection(object):
         repl.default_connection = self
         return self
 
-    def _sock_recv(self, length):
+    def _sock_recv_into(self, view):
         while True:
             try:
-                return self.socket.recv(length)
+                return self.socket.recv_into(view)
             except IOError as e:
                 if e.errno != errno.EINTR:
                     raise
@@ -167,14 +543,76 @@ class Connection(object):
                 if e.errno != errno.EINTR:
                     raise
 
-    def _start(self, term, **global_opt_args):
+    def _new_token(self):
         token = self.next_token
         self.next_token += 1
+        return token
 
-        # Construct query
-        query = p.Query()
-        query.type = p.Query.START
-        query.token = token
+    def _start(self, term, **global_opt_args):
+        query = self._start_query(term, global_opt_args)
+        return self._send_query(query, term, global_opt_args)
+
+    def _start_async(self, term, **global_opt_args):
+        raise RqlDriverError("Asynchronous queries require a multiplexed connection.")
+
+    # Sends all of the queries at once and then waits for their results, which
+    # are returned in the same order as the queries. The run options apply to
+    # every query. If any of the queries fails the first error is raised once
+    # all of the responses are in, and the cursors of the others are closed.
+    def run_many(self, queries, **global_opt_args):
+        if 'timeout' in global_opt_args:
+            raise RqlDriverError("The timeout run option is not supported by run_many.")
+
+        started = [ ]
+        try:
+            for term in queries:
+                opts = dict(global_opt_args)
+                started.append((self._start_query(term, opts), term, opts))
+        except:
+            # None of the queries were sent, they won't get a response
+            for query, term, opts in started:
+                self._query_stats.pop(query.token, None)
+            raise
+
+        if 'noreply' in global_opt_args and global_opt_args['noreply']:
+            self._send_queries([query for query, term, opts in started])
+            if self._query_stats:
+                for query, term, opts in started:
+                    if query.token in self._query_stats:
+                        self._finish_stats(self._query_stats[query.token])
+            return [None] * len(started)
+
+        responses = self._send_many([query for query, term, opts in started])
+
+        results = [ ]
+        error = None
+        for (query, term, opts), response in zip(started, responses):
+            try:
+                results.append(self._process_response(query, term, opts, response))
+            except (RqlError, RqlDriverError) as err:
+                if error is None:
+                    error = err
+
+        if error is not None:
+            for result in results:
+                if isinstance(result, Cursor):
+                    result.close()
+            raise error
+        return results
+
+    def _next_batch_async(self, cursor):
+        raise RqlDriverError("Asynchronous queries require a multiplexed connection.")
+
+    def _end_cursor_async(self, cursor):
+        raise RqlDriverError("Asynchronous queries require a multiplexed connection.")
+
+    def _start_query(self, term, global_opt_args):
+        token = self._new_token()
+
+        stats = None
+        if self.query_hooks:
+            stats = QueryStats(term)
+            stats.token = token
 
         # Set global opt args
 
@@ -186,79 +624,264 @@ class Connection(object):
             if self.db:
                global_opt_args['db'] = DB(self.db)
 
-        for k,v in global_opt_args.items():
-            pair = query.global_optargs.add()
-            pair.key = k
-            expr(v).build(pair.val)
+        if 'prefetch' in global_opt_args and global_opt_args['prefetch'] < 1:
+            raise RqlDriverError("The prefetch run option must be at least 1.")
+
+        if 'timeout' in global_opt_args and global_opt_args['timeout'] is not None and global_opt_args['timeout'] <= 0:
+            raise RqlDriverError("The timeout run option must be positive.")
+
+        if 'result_format' in global_opt_args and global_opt_args['result_format'] not in result_formats:
+            raise RqlDriverError("Unknown result_format run option \"%s\"." % global_opt_args['result_format'])
+
+        # The server reads batch_conf once when the query starts, the limits
+        # apply to every batch of the stream
+        batch_opts = [k for k in batch_conf_opt_args if k in global_opt_args]
+        if batch_opts:
+            batch_conf = dict(global_opt_args.get('batch_conf') or { })
+            for k in batch_opts:
+                v = global_opt_args[k]
+                if v <= 0:
+                    raise RqlDriverError("The %s run option must be positive." % k)
+                if k == 'max_batch_seconds':
+                    # The server takes the duration in microseconds
+                    v = int(v * 1000000)
+                batch_conf[batch_conf_opt_args[k]] = v
+            global_opt_args['batch_conf'] = batch_conf
+
+        if stats is not None:
+            build_start = time.time()
+
+        optargs = [(k, expr(v)) for k, v in global_opt_args.items() if k not in driver_opt_args]
+
+        if isinstance(term, BoundQuery):
+            # Prepared queries come with their term already serialized
+            query = EncodedStart(token, optargs, term._serialize())
+        elif direct_encoding:
+            query = EncodedStart(token, optargs, encode_term(term))
+        else:
+            # Construct query
+            query = _protobuf().Query()
+            query.type = p.Query.START
+            query.token = token
+
+            for k, v in optargs:
+                pair = query.global_optargs.add()
+                pair.key = k
+                v.build(pair.val)
 
-        # Compile query to protobuf
-        term.build(query.query)
-        return self._send_query(query, term, global_opt_args)
+            # Compile query to protobuf
+            term.build(query.query)
+
+        if stats is not None:
+            stats.build_time = time.time() - build_start
+            self._query_stats[token] = stats
+        return query
 
     def _handle_cursor_response(self, response):
+        self._prefetch(self._add_cursor_response(response))
+
+    # Adds the response to its cursor and returns the cursor, asking for more
+    # is left to the caller
+    def _add_cursor_response(self, response):
         cursor = self.cursor_cache[response.token]
-        cursor._extend(response)
         cursor.outstanding_requests -= 1
+        cursor._extend(response)
 
-        if response.type != p.Response.SUCCESS_PARTIAL and cursor.outstanding_requests == 0:
+        # Once the stream has ended or the cursor was closed, the cursor is
+        # only kept around until everything it asked for has been answered
+        if cursor.outstanding_requests == 0 and (response.type != p.Response.SUCCESS_PARTIAL or cursor.end_flag):
             del self.cursor_cache[response.token]
+            self._query_stats.pop(response.token, None)
+        return cursor
+
+    def _pop_cursor_response(self, cursor):
+        response = cursor._take_response()
+        self._prefetch(cursor)
+        return response
 
     def _continue_cursor(self, cursor):
-        self._async_continue_cursor(cursor)
-        self._handle_cursor_response(self._read_response(cursor.query.token))
+        if cursor.query.token not in self.cursor_cache:
+            raise RqlDriverError("Connection is closed.")
+        if cursor.outstanding_requests == 0:
+            self._async_continue_cursor(cursor)
+        try:
+            response = self._read_response(cursor.query.token, deadline=_deadline(cursor.opts))
+        except RqlTimeoutError as err:
+            self._cursor_timed_out(cursor, err)
+            raise
+        self._handle_cursor_response(response)
+
+    def _prefetch(self, cursor):
+        while cursor._should_prefetch():
+            self._async_continue_cursor(cursor)
 
+    # The cache is emptied when the connection is closed
     def _async_continue_cursor(self, cursor):
-        self.cursor_cache[cursor.query.token].outstanding_requests += 1
+        if cursor.query.token not in self.cursor_cache:
+            raise RqlDriverError("Connection is closed.")
+        cursor._continue_sent()
+        self._send_continue(cursor)
 
-        query = p.Query()
+    def _send_continue(self, cursor):
+        query = _protobuf().Query()
         query.type = p.Query.CONTINUE
         query.token = cursor.query.token
         self._send_query(query, cursor.term, cursor.opts, async=True)
 
     def _end_cursor(self, cursor):
-        self.cursor_cache[cursor.query.token].outstanding_requests += 1
+        if cursor.query.token not in self.cursor_cache:
+            # Closing the connection closed the cursor as well
+            return
+        self._stop_cursor(cursor)
+        # Read the responses to the CONTINUEs still in flight as well
+        while cursor.query.token in self.cursor_cache:
+            self._handle_cursor_response(self._read_response(cursor.query.token))
+
+    # Sends a STOP for the cursor without waiting for the response, the cursor
+    # stays in the cache until the responses still in flight have come in
+    def _stop_cursor(self, cursor):
+        if cursor.query.token not in self.cursor_cache:
+            raise RqlDriverError("Connection is closed.")
+        cursor.outstanding_requests += 1
 
-        query = p.Query()
+        query = _protobuf().Query()
         query.type = p.Query.STOP
         query.token = cursor.query.token
-        self._send_query(cursor.query, cursor.term, async=True)
-        self._handle_cursor_response(self._read_response(cursor.query.token))
+        self._send_query(query, cursor.term, async=True)
+
+    # The server can stop a stream between batches, the batch being computed
+    # is dropped when it comes in
+    def _cursor_timed_out(self, cursor, err):
+        if not cursor.end_flag:
+            cursor.end_flag = True
+            self._stop_cursor(cursor)
+        cursor._record_end(err)
+
+    # The server runs the queries of a connection one at a time and can't
+    # interrupt a query that's already running, the response to a query that
+    # timed out is dropped when it comes in instead. If the query started a
+    # stream it's stopped then.
+    def _abandon(self, token, err):
+        self._abandoned.add(token)
+        if token in self._query_stats:
+            self._finish_stats(self._query_stats[token], err)
+
+    def _handle_abandoned(self, response):
+        self._abandoned.discard(response.token)
+        if response.type == p.Response.SUCCESS_PARTIAL:
+            # Drop the response to the STOP as well
+            self._abandoned.add(response.token)
+            query = _protobuf().Query()
+            query.type = p.Query.STOP
+            query.token = response.token
+            self._send_query(query, None, async=True)
+
+    def _reset_buffer(self):
+        self._buf = bytearray(Connection.recv_buffer_size)
+        self._buf_start = 0
+        self._buf_end = 0
+
+    # Reads from the socket until at least `length` unread bytes are buffered.
+    # Returns False if the server closed the connection first.
+    def _fill_buffer(self, length):
+        while self._buf_end - self._buf_start < length:
+            if self._buf_start + length > len(self._buf):
+                # Move the unread bytes to the front of the buffer, or into a
+                # bigger one if they still wouldn't fit
+                pending = self._buf_end - self._buf_start
+                if length > len(self._buf):
+                    buf = bytearray(max(length, 2 * len(self._buf)))
+                else:
+                    buf = self._buf
+                buf[0:pending] = self._buf[self._buf_start:self._buf_end]
+                self._buf = buf
+                self._buf_start = 0
+                self._buf_end = pending
+
+            received = self._sock_recv_into(memoryview(self._buf)[self._buf_end:])
+            if received == 0:
+                return False
+            self._buf_end += received
+        return True
+
+    def _recv_response(self):
+        if not self._fill_buffer(4):
+            raise RqlDriverError("Connection is closed.")
 
-    def _read_response(self, token):
-        # We may get an async continue result, in which case we save it and read the next response
+        # Responses are only timed while some query is being recorded
+        timed = bool(self._query_stats)
+        if timed:
+            received = time.time()
+
+        # The first 4 bytes give the expected length of this response
+        (response_len,) = struct.unpack_from("<L", self._buf, self._buf_start)
+
+        if not self._fill_buffer(4 + response_len):
+            raise RqlDriverError("Connection is broken.")
+
+        if timed:
+            parse_start = time.time()
+
+        start = self._buf_start + 4
+        self._buf_start = start + response_len
+
+        # Construct response straight from the receive buffer, the parser
+        # is done with it before the next read can overwrite it
+        response = None
+        if direct_decoding:
+            response = decode_response(self._buf, start, self._buf_start)
+        if response is None:
+            response = _protobuf().Response()
+            response.ParseFromString(_parseable(memoryview(self._buf)[start:self._buf_start]))
+
+        if timed:
+            stats = self._query_stats.get(response.token)
+            if stats is not None:
+                if stats.first_byte_time is None:
+                    stats.first_byte_time = received - stats.sent_time
+                stats.parse_time += time.time() - parse_start
+                stats.bytes_in += 4 + response_len
+                stats.batches += 1
+
+        if self._buf_start == self._buf_end:
+            # Don't hold on to the memory of an unusually large response
+            if len(self._buf) > Connection.recv_buffer_size:
+                self._reset_buffer()
+            else:
+                self._buf_start = 0
+                self._buf_end = 0
+        return response
+
+    def _read_response(self, token, responses=None, deadline=None):
+        # We may get an async continue result or the response to another query
+        # in `responses`, in which case we save it and read the next response
         while True:
-            response_buf = b''
             try:
-                response_header = b''
-                while len(response_header) < 4:
-                    chunk = self._sock_recv(4)
-                    if len(chunk) == 0:
-                        raise RqlDriverError("Connection is closed.")
-                    response_header += chunk
-
-                # The first 4 bytes give the expected length of this response
-                (response_len,) = struct.unpack("<L", response_header)
-
-                while len(response_buf) < response_len:
-                    chunk = self._sock_recv(response_len - len(response_buf))
-                    if len(chunk) == 0:
-                        raise RqlDriverError("Connection is broken.")
-                    response_buf += chunk
+                if deadline is not None:
+                    # A timeout during a read leaves what was read so far in
+                    # the buffer, the read can be picked up again later
+                    self.socket.settimeout(max(deadline - time.time(), 0.001))
+                response = self._recv_response()
+            except socket.timeout:
+                raise RqlTimeoutError("Timed out waiting for the query result.")
             except KeyboardInterrupt as err:
                 # When interrupted while waiting for a response cancel the outstanding
                 # requests by resetting this connection
                 self.reconnect()
                 raise err
-
-            # Construct response
-            response = p.Response()
-            response.ParseFromString(response_buf)
+            finally:
+                if deadline is not None and self.socket:
+                    self.socket.settimeout(None)
 
             # Check that this is the response we were expecting
             if response.token == token:
                 return response
+            elif responses is not None and response.token in responses:
+                responses[response.token] = response
             elif response.token in self.cursor_cache:
                 self._handle_cursor_response(response)
+            elif response.token in self._abandoned:
+                self._handle_abandoned(response)
             else:
                 # This response is corrupted or not intended for us.
                 raise RqlDriverError("Unexpected response received.")
@@ -280,27 +903,68 @@ class Connection(object):
             frames = backtrace.frames or []
             raise RqlClientError(message, term, frames)
 
+    # Reads the responses to the given queries in whatever order they arrive
+    def _read_responses(self, tokens):
+        responses = dict.fromkeys(tokens)
+        for token in tokens:
+            if responses[token] is None:
+                responses[token] = self._read_response(token, responses)
+        return [responses[token] for token in tokens]
+
+    def _serialize_query(self, query):
+        query.accepts_r_json = True
+        stats = self._query_stats.get(query.token) if self._query_stats else None
+        if stats is None:
+            query_protobuf = query.SerializeToString()
+        else:
+            start = time.time()
+            query_protobuf = query.SerializeToString()
+            stats.sent_time = time.time()
+            stats.serialize_time += stats.sent_time - start
+            stats.bytes_out += 4 + len(query_protobuf)
+        return struct.pack("<L", len(query_protobuf)) + query_protobuf
+
+    # Writes all of the queries with a single send
+    def _send_queries(self, queries):
+        if not self.socket:
+            raise RqlDriverError("Connection is closed.")
+        self._sock_sendall(''.join(self._serialize_query(query) for query in queries))
+
+    def _send_many(self, queries):
+        self._send_queries(queries)
+        return self._read_responses([query.token for query in queries])
+
     def _send_query(self, query, term, opts={}, async=False):
         # Error if this connection has closed
         if not self.socket:
             raise RqlDriverError("Connection is closed.")
 
-        query.accepts_r_json = True
-
         # Send protobuf
-        query_protobuf = query.SerializeToString()
-        query_header = struct.pack("<L", len(query_protobuf))
-        self._sock_sendall(query_header + query_protobuf)
+        self._sock_sendall(self._serialize_query(query))
 
         if 'noreply' in opts and opts['noreply']:
+            if query.token in self._query_stats:
+                self._finish_stats(self._query_stats[query.token])
             return None
         elif async:
             return None
 
         # Get response
-        response = self._read_response(query.token)
-
-        self._check_error_response(response, term)
+        try:
+            response = self._read_response(query.token, deadline=_deadline(opts))
+        except RqlTimeoutError as err:
+            self._abandon(query.token, err)
+            raise
+        return self._process_response(query, term, opts, response)
+
+    def _process_response(self, query, term, opts, response):
+        stats = self._query_stats.get(query.token) if self._query_stats else None
+        try:
+            self._check_error_response(response, term)
+        except RqlError as err:
+            if stats is not None:
+                self._finish_stats(stats, err)
+            raise
 
         time_format = 'native'
         if 'time_format' in opts:
@@ -309,14 +973,30 @@ class Connection(object):
         # Sequence responses
         if response.type == p.Response.SUCCESS_PARTIAL or response.type == p.Response.SUCCESS_SEQUENCE:
             value = Cursor(self, query, term, opts)
+            value.stats = stats
             self.cursor_cache[query.token] = value
             value._extend(response)
+            if value.end_flag:
+                # The whole result came with the first response, the cursor
+                # reports its stats itself
+                del self.cursor_cache[query.token]
+                self._query_stats.pop(query.token, None)
+            else:
+                self._prefetch(value)
+            if stats is not None:
+                self._watch_cursor(value, stats)
 
         # Atom response
         elif response.type == p.Response.SUCCESS_ATOM:
             if len(response.response) < 1:
                 value = None
-            value = Datum.deconstruct(response.response[0], time_format)
+            if stats is None:
+                value = _result_decoder(opts)(response.response[0], time_format)
+            else:
+                start = time.time()
+                value = _result_decoder(opts)(response.response[0], time_format)
+                stats.deconstruct_time = time.time() - start
+                self._finish_stats(stats)
 
         # Noreply_wait response
         elif response.type == p.Response.WAIT_COMPLETE:
@@ -326,6 +1006,10 @@ class Connection(object):
         else:
             raise RqlDriverError("Unknown Response type %d encountered in response." % response.type)
 
+        # Responses read without protobuf have no profile
+        if response.profile is None:
+            return value
+
         try:
             if  Datum.deconstruct(response.profile) == None:
                 return value
@@ -335,5 +1019,392 @@ class Connection(object):
             # response.profile does not exist
             return value
 
-def connect(host='localhost', port=28015, db=None, auth_key="", timeout=20):
+# The result of a query running on a multiplexed connection. Callbacks added
+# with `add_done_callback` are run on the connection's reader thread as soon as
+# the result is in, so they must not wait on other queries on the same
+# connection. Exceptions raised by a callback are logged to the 'rethinkdb'
+# logger.
+class QueryFuture(object):
+    def __init__(self, conn=None):
+        self.conn = conn
+        self._value = None
+        self._error = None
+        self._done = threading.Event()
+        self._callbacks = [ ]
+
+        # Held while the future is resolved and while callbacks are added or
+        # taken to be run, so that each callback runs exactly once
+        self._lock = threading.Lock()
+
+    def _deliver(self, response):
+        self._set_result(response)
+
+    def _set_result(self, value):
+        with self._lock:
+            self._value = value
+            self._done.set()
+
+    def _set_error(self, error):
+        with self._lock:
+            self._error = error
+            self._done.set()
+
+    def _run_callbacks(self):
+        with self._lock:
+            callbacks = self._callbacks
+            self._callbacks = [ ]
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                # An exception here would kill the reader thread
+                logging.getLogger('rethinkdb').exception("Future callback %r failed.", callback)
+
+    def done(self):
+        return self._done.is_set()
+
+    # Callbacks added before the future is resolved are run by the thread
+    # that resolves it, the others right away
+    def add_done_callback(self, callback):
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def result(self, timeout=None):
+        if not self.done() and self.conn is not None and self.conn._reader is threading.current_thread():
+            raise RqlDriverError("Cannot wait for a query result on the connection's reader thread.")
+        if not self._done.wait(timeout):
+            raise RqlTimeoutError("Timed out waiting for the query result.")
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+# The future returned by `RqlQuery.run_async`, it converts the response into
+# a value or a cursor as soon as it comes in.
+class StartFuture(QueryFuture):
+    def __init__(self, conn, query, term, opts):
+        QueryFuture.__init__(self, conn)
+        self.query = query
+        self.term = term
+        self.opts = opts
+
+    def _deliver(self, response):
+        try:
+            self._set_result(self.conn._process_response(self.query, self.term, self.opts, response))
+        except Exception as err:
+            self._set_error(err)
+
+# A connection that can be shared by many threads. Every query still gets its
+# own token, but rather than each caller reading the socket until its own
+# response shows up, a single background thread reads all responses and hands
+# each one to the future or cursor waiting on its token.
+#
+# The server still runs the queries of a connection one at a time, in the
+# order they were sent, so a slow query holds up the queries sent after it on
+# the same socket. Multiplexing saves connections, not query time: use a pool
+# for queries that should run concurrently on the server.
+class MultiplexedConnection(Connection):
+    def __init__(self, host, port, db, auth_key, timeout):
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._waiters = { }
+        self._batch_waiters = { }
+        self._close_waiters = { }
+        self._cursor_conds = { }
+        self._reader = None
+        self._reader_error = None
+        Connection.__init__(self, host, port, db, auth_key, timeout)
+
+    def reconnect(self, noreply_wait=True):
+        Connection.reconnect(self, noreply_wait)
+
+        # The handshake is done synchronously, so only start reading in the
+        # background once the connection is ready for queries.
+        self._reader_error = None
+        self._reader = threading.Thread(target=self._reader_loop, name="rethinkdb-reader")
+        self._reader.daemon = True
+        self._reader.start()
+
+    def close(self, noreply_wait=True):
+        Connection.close(self, noreply_wait)
+
+        # Shutting down the socket wakes the reader up, wait for it to
+        # release everything still waiting on this connection.
+        reader = self._reader
+        self._reader = None
+        if reader is not None and reader is not threading.current_thread():
+            reader.join()
+
+    def _new_token(self):
+        with self._lock:
+            return Connection._new_token(self)
+
+    def _sock_sendall(self, data):
+        with self._write_lock:
+            return Connection._sock_sendall(self, data)
+
+    # The future has to be registered before the query goes out, otherwise
+    # the reader could receive the response before anyone expects it.
+    def _send_with_future(self, query, term, opts, future):
+        with self._lock:
+            if self._reader_error is not None:
+                raise self._reader_error
+            self._waiters[query.token] = future
+        try:
+            Connection._send_query(self, query, term, opts, async=True)
+        except:
+            with self._lock:
+                self._waiters.pop(query.token, None)
+            raise
+        return future
+
+    def _send_many(self, queries):
+        futures = [QueryFuture(self) for query in queries]
+        with self._lock:
+            if self._reader_error is not None:
+                raise self._reader_error
+            for query, future in zip(queries, futures):
+                self._waiters[query.token] = future
+        try:
+            self._send_queries(queries)
+        except:
+            with self._lock:
+                for query in queries:
+                    self._waiters.pop(query.token, None)
+            raise
+        return [future.result() for future in futures]
+
+    def _send_query(self, query, term, opts={}, async=False):
+        if async or ('noreply' in opts and opts['noreply']):
+            return Connection._send_query(self, query, term, opts, async)
+
+        future = self._send_with_future(query, term, opts, QueryFuture(self))
+        timeout = opts['timeout'] if 'timeout' in opts else None
+        try:
+            response = future.result(timeout)
+        except RqlTimeoutError as err:
+            with self._lock:
+                timed_out = self._waiters.get(query.token) is future
+                if timed_out:
+                    del self._waiters[query.token]
+                    self._abandon(query.token, err)
+            if timed_out:
+                raise
+            # The response came in just now
+            response = future.result()
+        return self._process_response(query, term, opts, response)
+
+    def _start_async(self, term, **global_opt_args):
+        query = self._start_query(term, global_opt_args)
+        future = StartFuture(self, query, term, global_opt_args)
+        if 'noreply' in global_opt_args and global_opt_args['noreply']:
+            Connection._send_query(self, query, term, global_opt_args)
+            future._set_result(None)
+            return future
+        return self._send_with_future(query, term, global_opt_args, future)
+
+    def _cursor_cond(self, token):
+        if token not in self._cursor_conds:
+            self._cursor_conds[token] = threading.Condition(self._lock)
+        return self._cursor_conds[token]
+
+    # CONTINUEs are counted with the lock held and sent after releasing it, so
+    # that a slow send doesn't hold up the reader thread
+    def _prefetch(self, cursor):
+        while True:
+            with self._lock:
+                if not cursor._should_prefetch() or cursor.query.token not in self.cursor_cache:
+                    return
+                cursor._continue_sent()
+            self._send_continue(cursor)
+
+    def _pop_cursor_response(self, cursor):
+        with self._lock:
+            response = cursor._take_response()
+        self._prefetch(cursor)
+        return response
+
+    def _continue_cursor(self, cursor):
+        token = cursor.query.token
+        deadline = _deadline(cursor.opts)
+        with self._lock:
+            ask = cursor.outstanding_requests == 0 and len(cursor.responses) == 0 and not cursor.end_flag
+            if ask:
+                if token not in self.cursor_cache:
+                    raise RqlDriverError("Connection is closed.")
+                cursor._continue_sent()
+        if ask:
+            self._send_continue(cursor)
+        with self._lock:
+            cond = self._cursor_cond(token)
+            while len(cursor.responses) == 0 and not cursor.end_flag:
+                if token not in self.cursor_cache:
+                    raise RqlDriverError("Connection is closed.")
+                if deadline is None:
+                    cond.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    err = RqlTimeoutError("Timed out waiting for the query result.")
+                    self._cursor_timed_out(cursor, err)
+                    raise err
+                cond.wait(remaining)
+
+    def _next_batch_async(self, cursor):
+        token = cursor.query.token
+        future = QueryFuture(self)
+        with self._lock:
+            if len(cursor.responses) == 0 and not cursor.end_flag:
+                if token not in self.cursor_cache:
+                    raise RqlDriverError("Connection is closed.")
+                self._batch_waiters.setdefault(token, [ ]).append(future)
+                ask = cursor.outstanding_requests == 0
+                if ask:
+                    cursor._continue_sent()
+                waiting = True
+            else:
+                waiting = False
+                response = self._take_batch(cursor)
+        if waiting:
+            if ask:
+                self._send_continue(cursor)
+            return future
+        self._resolve_batch(cursor, future, response)
+        future._run_callbacks()
+        return future
+
+    # Takes the next batch off the cursor for a future, or None once the
+    # cursor is exhausted. Must be called with the lock held, the batch is
+    # decoded by `_resolve_batch` after releasing it.
+    def _take_batch(self, cursor):
+        if len(cursor.responses) == 0:
+            return None
+        return cursor._take_response()
+
+    def _resolve_batch(self, cursor, future, response):
+        if response is None:
+            cursor._record_end()
+            future._set_result(None)
+            return
+        try:
+            self._prefetch(cursor)
+            future._set_result(cursor._decode_response(response))
+        except Exception as err:
+            future._set_error(err)
+
+    def _end_cursor_async(self, cursor):
+        token = cursor.query.token
+        future = QueryFuture(self)
+        with self._lock:
+            cursor.end_flag = True
+            if token in self.cursor_cache:
+                self.cursor_cache[token].outstanding_requests += 1
+                self._close_waiters.setdefault(token, [ ]).append(future)
+            else:
+                future._set_result(None)
+        if future.done():
+            return future
+
+        query = _protobuf().Query()
+        query.type = p.Query.STOP
+        query.token = token
+        self._send_query(query, cursor.term, async=True)
+        return future
+
+    def _end_cursor(self, cursor):
+        self._end_cursor_async(cursor).result()
+
+    def _stop_cursor(self, cursor):
+        self._end_cursor_async(cursor)
+
+    def _reader_loop(self):
+        try:
+            while True:
+                self._dispatch(self._recv_response())
+        except RqlDriverError as err:
+            self._fail(err)
+        except Exception as err:
+            self._fail(RqlDriverError("Connection is closed."))
+
+    # Routes the response to whatever waits on its token. Only that is done
+    # with the lock held: results are decoded and CONTINUE and STOP queries are
+    # sent after releasing it, so that they don't hold up the other threads.
+    def _dispatch(self, response):
+        token = response.token
+        future = None
+        abandoned = False
+        cursor = None
+        batches = [ ]
+        finished = [ ]
+        with self._lock:
+            future = self._waiters.pop(token, None)
+            if future is not None:
+                finished.append(future)
+
+            elif token in self._abandoned:
+                abandoned = True
+
+            elif token in self.cursor_cache:
+                cursor = self._add_cursor_response(response)
+
+                batch_waiters = self._batch_waiters.get(token, [ ])
+                while batch_waiters and (len(cursor.responses) > 0 or cursor.end_flag):
+                    batch_future = batch_waiters.pop(0)
+                    batches.append((batch_future, self._take_batch(cursor)))
+                    finished.append(batch_future)
+
+                if token in self._cursor_conds:
+                    self._cursor_conds[token].notify_all()
+
+                if token not in self.cursor_cache:
+                    self._cursor_conds.pop(token, None)
+                    self._batch_waiters.pop(token, None)
+                    for close_future in self._close_waiters.pop(token, [ ]):
+                        close_future._set_result(None)
+                        finished.append(close_future)
+
+            else:
+                # This response is corrupted or not intended for us.
+                raise RqlDriverError("Unexpected response received.")
+
+        if future is not None:
+            future._deliver(response)
+        elif abandoned:
+            self._handle_abandoned(response)
+        elif cursor is not None:
+            self._prefetch(cursor)
+            for batch_future, batch in batches:
+                self._resolve_batch(cursor, batch_future, batch)
+
+        for future in finished:
+            future._run_callbacks()
+
+    def _fail(self, err):
+        # Nothing more will be read from this socket, release every thread
+        # still waiting on it.
+        with self._lock:
+            self._reader_error = err
+            futures = self._waiters.values()
+            for waiters in self._batch_waiters.values() + self._close_waiters.values():
+                futures.extend(waiters)
+            self._waiters = { }
+            self._batch_waiters = { }
+            self._close_waiters = { }
+            self.cursor_cache = { }
+            self._query_stats = { }
+            self._abandoned = set()
+            for future in futures:
+                future._set_error(err)
+            for cond in self._cursor_conds.values():
+                cond.notify_all()
+            self._cursor_conds = { }
+
+        for future in futures:
+            future._run_callbacks()
+
+def connect(host='localhost', port=28015, db=None, auth_key="", timeout=20, multiplex=False):
+    if multiplex:
+        return MultiplexedConnection(host, port, db, auth_key, timeout)
     return Connection(host, port, db, auth_key, timeout)
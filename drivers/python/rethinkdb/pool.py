@@ -0,0 +1,190 @@
+# Copyright 2010-2013 RethinkDB, all rights reserved.
+
+__all__ = ['ConnectionPool']
+
+import os
+import socket
+import time
+import threading
+from contextlib import contextmanager
+
+from rethinkdb.net import connect
+from rethinkdb.errors import RqlDriverError
+
+# After a fork the child holds copies of the parent's sockets. Shutting them
+# down would cut the parent off as well, so only drop the child's descriptor.
+def _release_inherited(conn):
+    if conn.socket:
+        try:
+            conn.socket.close()
+        except socket.error:
+            pass
+        conn.socket = None
+    conn.cursor_cache = { }
+
+# Closes a connection without waiting on the server, a connection that's
+# already broken is just dropped
+def _discard(conn):
+    try:
+        conn.close(noreply_wait=False)
+    except (RqlDriverError, socket.error):
+        pass
+
+# A pool of connections to a single RethinkDB host. Connections are created on
+# demand up to `max_size`, `min_size` of them are kept open even when idle, and
+# the rest are closed once they have been idle for `max_idle_time` seconds.
+# Connections that have been idle for longer than `check_interval` seconds are
+# checked with a round trip to the server before being handed out again.
+#
+# A connection must not be returned to the pool while a cursor obtained from it
+# is still being read, as the next user would receive the cursor's responses.
+class ConnectionPool(object):
+    def __init__(self, host='localhost', port=28015, db=None, auth_key="", timeout=20,
+                 min_size=0, max_size=10, wait_timeout=10, max_idle_time=300, check_interval=30):
+        if max_size < 1:
+            raise RqlDriverError("Connection pool max_size must be at least 1.")
+        if min_size < 0 or min_size > max_size:
+            raise RqlDriverError("Connection pool min_size must be between 0 and max_size.")
+
+        self.host = host
+        self.port = port
+        self.db = db
+        self.auth_key = auth_key
+        self.timeout = timeout
+        self.min_size = min_size
+        self.max_size = max_size
+        self.wait_timeout = wait_timeout
+        self.max_idle_time = max_idle_time
+        self.check_interval = check_interval
+        self.closed = False
+
+        self._reset()
+        for i in xrange(min_size):
+            self._size += 1
+            self._idle.append((self._connect(), time.time()))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = [ ]
+        self._in_use = set()
+        self._size = 0
+
+    def _connect(self):
+        return connect(self.host, self.port, self.db, self.auth_key, self.timeout)
+
+    def _check_fork(self):
+        if os.getpid() != self._pid:
+            for conn, last_used in self._idle:
+                _release_inherited(conn)
+            for conn in self._in_use:
+                _release_inherited(conn)
+            self._reset()
+
+    def _is_healthy(self, conn):
+        try:
+            conn.noreply_wait()
+            return True
+        except (RqlDriverError, socket.error):
+            return False
+
+    # Returns the connections that have been idle for too long. Must be called
+    # with the lock held, the connections must be closed after releasing it.
+    def _evict_idle(self):
+        evicted = [ ]
+        now = time.time()
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.max_idle_time:
+            evicted.append(self._idle.pop(0)[0])
+            self._size -= 1
+        return evicted
+
+    def get(self, timeout=None):
+        if timeout is None:
+            timeout = self.wait_timeout
+        self._check_fork()
+
+        deadline = time.time() + timeout
+        conn = None
+        with self._cond:
+            while True:
+                if self.closed:
+                    raise RqlDriverError("Connection pool is closed.")
+                if self._idle:
+                    # Reuse the most recently returned connection so the ones
+                    # at the front of the list get a chance to idle out.
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise RqlDriverError("Timed out waiting for a connection from the pool.")
+                self._cond.wait(remaining)
+
+        try:
+            if conn is None:
+                conn = self._connect()
+            elif not conn.socket or (time.time() - last_used > self.check_interval and not self._is_healthy(conn)):
+                conn.reconnect(noreply_wait=False)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._in_use.add(conn)
+        return conn
+
+    def put(self, conn):
+        self._check_fork()
+
+        with self._cond:
+            if conn not in self._in_use:
+                # Checked out before a fork, or not from this pool at all
+                _release_inherited(conn)
+                return
+            self._in_use.remove(conn)
+
+            # The server keeps running a query that timed out until it's
+            # done, unless the connection is closed
+            if self.closed or not conn.socket or conn._abandoned:
+                self._size -= 1
+                evicted = [conn]
+            else:
+                self._idle.append((conn, time.time()))
+                evicted = self._evict_idle()
+            self._cond.notify()
+
+        for conn in evicted:
+            _discard(conn)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.get(timeout)
+        try:
+            yield conn
+        finally:
+            self.put(conn)
+
+    # Closes the idle connections, connections that are in use are closed as
+    # they are returned.
+    def close(self):
+        self._check_fork()
+
+        with self._cond:
+            self.closed = True
+            idle = self._idle
+            self._idle = [ ]
+            self._size -= len(idle)
+            self._cond.notify_all()
+
+        for conn, last_used in idle:
+            _discard(conn)
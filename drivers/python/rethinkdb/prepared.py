@@ -0,0 +1,152 @@
+# Copyright 2010-2013 RethinkDB, all rights reserved.
+
+__all__ = ['prepare', 'PreparedQuery', 'BoundQuery']
+
+import numbers
+import types
+
+from rethinkdb.ast import RqlQuery, Datum, expr, _no_optargs
+from rethinkdb.encode import encode_term, _encode_datum, _varint, _field, \
+    _term_type_key, _term_args_key, _term_optargs_key, _pair_key_key, _pair_val_key
+from rethinkdb.errors import RqlDriverError
+
+# Serializes a value as a DATUM term the same way `Datum.build` does, other
+# values go through `expr`.
+def _serialize_value(value):
+    if value is None or isinstance(value, (bool, numbers.Real) + types.StringTypes):
+        return _encode_datum(value)
+    return encode_term(expr(value))
+
+# The placeholder a prepared query's function is called with
+class Param(RqlQuery):
+    __slots__ = ('index',)
+    args = ()
+    optargs = _no_optargs
+    has_ivar = False
+
+    def __init__(self, index):
+        self.index = index
+
+    def build(self, term):
+        raise RqlDriverError("Parameters of a prepared query can only be used in the prepared query.")
+
+    def compose(self, args, optargs):
+        return 'param_%d' % self.index
+
+# Compiles a term into a template: a string for terms without parameters, a
+# parameter index, or a list of strings and (key, template) fields whose
+# lengths are only known once the parameters are.
+def _compile(term):
+    if isinstance(term, Param):
+        return term.index
+    if isinstance(term, Datum):
+        return _serialize_value(term.data)
+    if type(term).build.im_func is not RqlQuery.build.im_func:
+        return encode_term(term)
+
+    fields = [_term_type_key + _varint(term.tt)]
+    for arg in term.args:
+        fields.append((_term_args_key, _compile(arg)))
+    for k, v in term.optargs.items():
+        if isinstance(k, unicode):
+            k = k.encode('utf-8')
+        pair = _join([(_pair_key_key, k), (_pair_val_key, _compile(v))])
+        fields.append((_term_optargs_key, pair))
+    return _join(fields)
+
+# Joins serialized fields and (key, template) fields into a template
+def _join(fields):
+    parts = [ ]
+    for field in fields:
+        if not isinstance(field, str):
+            key, template = field
+            if not isinstance(template, str):
+                parts.append(field)
+                continue
+            field = _field(key, template)
+        if parts and isinstance(parts[-1], str):
+            parts[-1] += field
+        else:
+            parts.append(field)
+    if len(parts) == 1 and isinstance(parts[0], str):
+        return parts[0]
+    return parts
+
+def _render(template, values):
+    if isinstance(template, str):
+        return template
+    if isinstance(template, int):
+        return values[template]
+    out = [ ]
+    for part in template:
+        if isinstance(part, str):
+            out.append(part)
+        else:
+            data = _render(part[1], values)
+            out.append(part[0])
+            out.append(_varint(len(data)))
+            out.append(data)
+    return ''.join(out)
+
+# A query template. The function is called once with placeholders for its
+# arguments and the resulting query is serialized up front, calling the
+# prepared query with values only serializes the values. The arguments can
+# only be used as ReQL values in the function, not inspected in Python.
+#
+#   get_user = r.prepare(lambda key: r.table('users').get(key))
+#   get_user(5).run(conn)
+class PreparedQuery(object):
+    def __init__(self, func):
+        self.func = func
+        self.argcount = func.func_code.co_argcount
+        term = expr(func(*[Param(i) for i in xrange(self.argcount)]))
+        self.template = _compile(term)
+
+    def __call__(self, *args):
+        if len(args) != self.argcount:
+            raise RqlDriverError("Prepared query expected %d arguments but found %d." % (self.argcount, len(args)))
+        return BoundQuery(self, args)
+
+    def _serialize(self, args):
+        return _render(self.template, [_serialize_value(arg) for arg in args])
+
+# A prepared query with its arguments. The query itself is only built when
+# it's needed for printing or as part of another query.
+class BoundQuery(RqlQuery):
+    __slots__ = ('prepared', 'params', '_term')
+
+    def __init__(self, prepared, params):
+        self.prepared = prepared
+        self.params = params
+        self._term = None
+
+    @property
+    def term(self):
+        if self._term is None:
+            self._term = expr(self.prepared.func(*self.params))
+        return self._term
+
+    @property
+    def args(self):
+        return self.term.args
+
+    @property
+    def optargs(self):
+        return self.term.optargs
+
+    @property
+    def has_ivar(self):
+        return self.term.has_ivar
+
+    def build(self, term):
+        self.term.build(term)
+
+    def compose(self, args, optargs):
+        return self.term.compose(args, optargs)
+
+    # The serialized term
+    def _serialize(self):
+        return self.prepared._serialize(self.params)
+
+def prepare(func):
+    return PreparedQuery(func)
@@ -0,0 +1,146 @@
+# Copyright 2010-2013 RethinkDB, all rights reserved.
+
+# Analysis of the profiles returned by queries run with `profile=True`
+#
+#   from rethinkdb import profile
+#   result = query.run(conn, profile=True)
+#   root = profile.parse(result)
+#   print root.format()
+#   print profile.folded_stacks(root)
+
+__all__ = ['ProfileNode', 'parse', 'rollup', 'folded_stacks', 'diff']
+
+import re
+
+_evaluating = re.compile(r'^Evaluating (.+)\.$')
+
+# A node of a profile tree. Times are in milliseconds like the server's.
+#
+#   'query'     the root, its children are the top level tasks
+#   'task'      a task the server timed, `description` says what it was
+#   'sample'    a task done `samples` times, timed on average
+#   'parallel'  tasks that ran in parallel, each child is a 'branch'
+#   'branch'    the tasks of one of the parallel jobs
+#
+# The total time of a parallel node is the time of its longest branch, the
+# self time of a task is what's left of its time after its children's.
+class ProfileNode(object):
+    def __init__(self, kind, description, duration, children, samples=1):
+        self.kind = kind
+        self.description = description
+        self.duration = duration
+        self.children = children
+        self.samples = samples
+
+        # The term type of tasks that evaluate a term
+        self.term = None
+        if description is not None:
+            match = _evaluating.match(description)
+            if match is not None:
+                self.term = match.group(1)
+
+    @property
+    def self_time(self):
+        if self.kind == 'parallel' or self.kind == 'branch':
+            return 0.0
+        return max(self.duration - sum(child.duration for child in self.children), 0.0)
+
+    @property
+    def name(self):
+        if self.kind == 'parallel':
+            return 'parallel'
+        if self.kind == 'branch':
+            return 'branch'
+        return self.description
+
+    # Yields the nodes of the tree with the names of their ancestors, self
+    # included, from the root down
+    def walk(self, path=()):
+        path = path + (self.name,)
+        yield path, self
+        for child in self.children:
+            for item in child.walk(path):
+                yield item
+
+    # An indented text rendering of the tree with total and self times
+    def format(self, indent=0):
+        if self.kind == 'sample':
+            line = '%s%s  %.3fms (%d samples)' % ('  ' * indent, self.name, self.duration, self.samples)
+        else:
+            line = '%s%s  %.3fms, self %.3fms' % ('  ' * indent, self.name, self.duration, self.self_time)
+        return '\n'.join([line] + [child.format(indent + 1) for child in self.children])
+
+    def __repr__(self):
+        return 'ProfileNode(%r, %r, %r)' % (self.kind, self.description, self.duration)
+
+def _parse_tasks(tasks):
+    nodes = [ ]
+    for task in tasks:
+        if 'parallel_tasks' in task:
+            branches = [ ]
+            for branch in task['parallel_tasks']:
+                children = _parse_tasks(branch)
+                branches.append(ProfileNode('branch', None, sum(child.duration for child in children), children))
+            duration = max([branch.duration for branch in branches] or [0.0])
+            nodes.append(ProfileNode('parallel', None, duration, branches))
+        elif 'n_samples' in task:
+            samples = int(task['n_samples'])
+            nodes.append(ProfileNode('sample', task['description'], task['mean_duration(ms)'] * samples, [ ], samples))
+        else:
+            nodes.append(ProfileNode('task', task['description'], task['duration(ms)'], _parse_tasks(task['sub_tasks'])))
+    return nodes
+
+# Parses a profile, or the result of a query run with `profile=True`, into a
+# tree of `ProfileNode`s
+def parse(profile):
+    if isinstance(profile, ProfileNode):
+        return profile
+    if isinstance(profile, dict) and 'profile' in profile:
+        profile = profile['profile']
+    children = _parse_tasks(profile)
+    return ProfileNode('query', 'query', sum(child.duration for child in children), children)
+
+# Sums up the time spent evaluating each term type. Returns a dict of
+# (count, self time, total time) by term type, where the total time of a
+# term nested in a term of the same type is only counted once.
+def rollup(profile):
+    totals = { }
+    def visit(node, enclosing):
+        if node.term is not None:
+            count, self_time, total_time = totals.get(node.term, (0, 0.0, 0.0))
+            if node.term not in enclosing:
+                total_time += node.duration
+            totals[node.term] = (count + 1, self_time + node.self_time, total_time)
+            enclosing = enclosing | frozenset([node.term])
+        for child in node.children:
+            visit(child, enclosing)
+    visit(parse(profile), frozenset())
+    return totals
+
+def _stack_times(profile):
+    times = { }
+    for path, node in parse(profile).walk():
+        if node.self_time > 0:
+            stack = ';'.join(name.replace(';', ',') for name in path)
+            times[stack] = times.get(stack, 0.0) + node.self_time
+    return times
+
+# Renders the profile in the folded stack format read by flame graph tools,
+# a line per stack with its self time in microseconds
+def folded_stacks(profile):
+    lines = [ ]
+    for stack, time in sorted(_stack_times(profile).items()):
+        microseconds = int(round(time * 1000))
+        if microseconds > 0:
+            lines.append('%s %d' % (stack, microseconds))
+    return '\n'.join(lines)
+
+# Compares two profiles of the same query stack by stack. Returns a list of
+# (stack, time before, time after) with the self times of each stack in
+# milliseconds, the largest changes first.
+def diff(before, after):
+    before = _stack_times(before)
+    after = _stack_times(after)
+    changes = [(stack, before.get(stack, 0.0), after.get(stack, 0.0)) for stack in set(before) | set(after)]
+    changes.sort(key=lambda change: abs(change[2] - change[1]), reverse=True)
+    return changes
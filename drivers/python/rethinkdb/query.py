@@ -1,5 +1,5 @@
 from .ast import *
-from . import ql2_pb2 as p
+from . import ql2_enums as p
 import datetime
 
 """
@@ -134,6 +134,8 @@ def now():
     return Now()
 
 class RqlTimeName(RqlQuery):
+    __slots__ = ()
+
     def compose(self, args, optargs):
         return 'r.'+self.st
 
@@ -275,6 +275,218 @@ class TestConnection(TestWithConnection):
         c = r.connect(port=self.port)
         r.table('t2').run(c, db='db2')
 
+    def test_run_many(self):
+        c = r.connect(port=self.port)
+        r.db('test').table_create('t1').run(c)
+        r.table('t1').insert([{'id':i} for i in xrange(0, 10)]).run(c)
+
+        results = c.run_many([r.table('t1').get(i) for i in xrange(0, 10)] + [r.table('t1').count()])
+        self.assertEqual(results, [{'id':i} for i in xrange(0, 10)] + [10])
+
+        self.assertRaisesRegexp(
+            r.RqlRuntimeError, "Table `t2` does not exist.",
+            c.run_many, [r.table('t1').count(), r.table('t2').count()])
+        self.assertEqual(r.expr(1).run(c), 1)
+
+        # Rejected options leave no queries behind
+        c.add_query_hook(lambda stats: None)
+        self.assertRaisesRegexp(
+            r.RqlDriverError, "The timeout run option is not supported by run_many.",
+            c.run_many, [r.expr(1), r.expr(2)], timeout=1)
+        self.assertRaisesRegexp(
+            r.RqlDriverError, "The prefetch run option must be at least 1.",
+            c.run_many, [r.expr(1), r.expr(2)], prefetch=0)
+        self.assertEqual(c._query_stats, { })
+
+    def test_prepare(self):
+        c = r.connect(port=self.port)
+        r.db('test').table_create('t1').run(c)
+        r.table('t1').insert([{'id':i, 'x':i * 2} for i in xrange(0, 10)]).run(c)
+
+        get = r.prepare(lambda key: r.table('t1').get(key))
+        self.assertEqual([get(i).run(c) for i in xrange(0, 10)], [{'id':i, 'x':i * 2} for i in xrange(0, 10)])
+        self.assertEqual(get(20).run(c), None)
+
+        between = r.prepare(lambda lo, hi: r.table('t1').filter(lambda doc: (doc['x'] >= lo) & (doc['x'] < hi)).count())
+        self.assertEqual(between(4, 10).run(c), 3)
+        self.assertEqual(c.run_many([between(0, 4), between(10, 100)]), [2, 5])
+
+        self.assertRaisesRegexp(
+            r.RqlRuntimeError, "Expected type NUMBER but found STRING",
+            r.prepare(lambda x: r.expr(x) + 1)('a').run, c)
+        self.assertRaisesRegexp(
+            r.RqlDriverError, "Prepared query expected 2 arguments but found 1.",
+            between, 1)
+
+    def test_json_decoder(self):
+        c = r.connect(port=self.port)
+        query = r.expr({'a': [r.epoch_time(0), 1], 'b': '$reql_type$'})
+
+        self.assertEqual(query.run(c)['a'][0].year, 1970)
+        self.assertEqual(query.run(c, time_format='raw')['a'][0]['$reql_type$'], 'TIME')
+        self.assertEqual(query.run(c, time_format='epoch')['a'][0], 0)
+        self.assertEqual(r.expr({'a': [1]}).run(c), {'a': [1]})
+
+        import json
+        r.set_json_decoder(json)
+        self.assertEqual(query.run(c)['a'][0].year, 1970)
+        r.set_json_decoder('json')
+
+        self.assertRaisesRegexp(
+            r.RqlDriverError, "does not have a JSONDecoder class.",
+            r.set_json_decoder, 'os')
+
+    def test_raw_json(self):
+        import json
+        c = r.connect(port=self.port)
+        r.db('test').table_create('t1').run(c)
+        r.table('t1').insert([{'id':i} for i in xrange(0, 10)]).run(c)
+
+        rows = list(r.table('t1').order_by('id').run(c, result_format='raw_json'))
+        self.assertEqual([json.loads(row) for row in rows], [{'id':i} for i in xrange(0, 10)])
+        self.assertEqual(json.loads(r.table('t1').get(1).run(c, result_format='raw_json')), {'id':1})
+
+        self.assertRaisesRegexp(
+            r.RqlDriverError, "Unknown result_format run option \"xml\".",
+            r.expr(1).run, c, result_format='xml')
+
+    def test_lazy_documents(self):
+        c = r.connect(port=self.port)
+        r.db('test').table_create('t1').run(c)
+        r.table('t1').insert([{'id':i, 'a':{'id':'nested'}, 's':'"id": 5', 't':r.epoch_time(i)} for i in xrange(0, 10)]).run(c)
+
+        rows = list(r.table('t1').order_by('id').run(c, result_format='lazy'))
+        self.assertEqual([row['id'] for row in rows], range(0, 10))
+        self.assertEqual(rows[1]['t'].year, 1970)
+        self.assertEqual(rows[1]['a'], {'id':'nested'})
+        self.assertEqual(rows[1].get('missing'), None)
+        self.assertEqual(sorted(rows[1].keys()), ['a', 'id', 's', 't'])
+        self.assertEqual(rows[1].to_dict(), r.table('t1').get(1).run(c))
+
+    def test_to_columns(self):
+        c = r.connect(port=self.port)
+        r.db('test').table_create('t1').run(c)
+        r.table('t1').insert([{'id':i, 'x':i * 0.5} for i in xrange(0, 100)] + [{'id':100}]).run(c)
+
+        columns, masks = r.table('t1').order_by('id').run(c).to_columns(['id', 'x'], {'id':'l'}, use_numpy=False)
+        self.assertEqual(columns['id'].tolist(), range(0, 101))
+        self.assertEqual(columns['x'].tolist(), [i * 0.5 for i in xrange(0, 100)] + [0])
+        self.assertEqual(masks['x'].tolist(), [0] * 100 + [1])
+
+        self.assertRaisesRegexp(
+            r.RqlDriverError, "Cursor.to_columns requires rows that are objects.",
+            r.table('t1').map(r.row['id']).run(c).to_columns, ['id'])
+
+    def test_bulk_writer(self):
+        c = r.connect(port=self.port)
+        r.db('test').table_create('t1').run(c)
+
+        with r.BulkWriter(c, 't1', batch_size=100) as writer:
+            for i in xrange(0, 1050):
+                writer.write({'id':i})
+            self.assertEqual(writer.checkpoint(), [])
+            self.assertEqual(r.table('t1').count().run(c), 1050)
+            writer.write({'id':2000})
+        self.assertEqual(r.table('t1').count().run(c), 1051)
+
+        # Without a multiplexed connection, a batch that got too old is sent
+        # by the next write rather than by a thread of the writer
+        writer = r.BulkWriter(c, 't1', flush_interval=0)
+        writer.write({'id':2001})
+        c.noreply_wait()
+        self.assertEqual(r.table('t1').count().run(c), 1052)
+        self.assertEqual(writer.close(), [])
+
+        # Errors are reported per batch on multiplexed connections. The first
+        # batch only has new documents, the second one has a single duplicate.
+        c = r.connect(port=self.port, multiplex=True)
+        writer = r.BulkWriter(c, r.table('t1'), batch_size=10, flush_interval=None)
+        for i in xrange(0, 19):
+            writer.write({'id':i + 1052})
+        writer.write({'id':0})
+        errors = writer.close()
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(len(errors[0][0]), 10)
+        self.assertEqual(errors[0][1]['errors'], 1)
+        self.assertEqual(r.table('t1').count().run(c), 1071)
+
+    def test_query_hooks(self):
+        c = r.connect(port=self.port)
+        stats = [ ]
+        c.add_query_hook(stats.append)
+
+        r.expr(1).run(c)
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(stats[0].batches, 1)
+        self.assertGreater(stats[0].bytes_out, 0)
+        self.assertGreater(stats[0].bytes_in, 0)
+        self.assertGreaterEqual(stats[0].total_time, stats[0].first_byte_time)
+
+        r.db('test').table_create('t1').run(c)
+        r.table('t1').insert([{'id':i} for i in xrange(0, 1000)]).run(c)
+        del stats[:]
+
+        # Cursors are reported once they're read to the end
+        cursor = r.table('t1').run(c, max_batch_rows=100)
+        self.assertEqual(len(stats), 0)
+        self.assertEqual(len(list(cursor)), 1000)
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(stats[0].batches, 10)
+
+        # Or once they're closed or garbage-collected, which leaves no stats
+        # behind on the connection
+        del stats[:]
+        r.table('t1').run(c, max_batch_rows=100).close()
+        cursor = r.table('t1').limit(10).run(c)
+        next(iter(cursor))
+        del cursor
+        self.assertEqual(len(stats), 2)
+        self.assertEqual(c._query_stats, { })
+
+        self.assertRaises(r.RqlRuntimeError, r.error('boom').run, c)
+        self.assertIsInstance(stats[2].error, r.RqlRuntimeError)
+
+        log = r.SlowQueryLog(threshold=0)
+        c.add_query_hook(log)
+        c.remove_query_hook(stats.append)
+        r.expr(1).run(c)
+        self.assertEqual(len(stats), 3)
+        self.assertEqual(log.slow_queries, 1)
+
+    def test_close_during_iteration(self):
+        c = r.connect(port=self.port)
+        r.db('test').table_create('t1').run(c)
+        r.table('t1').insert([{'id':i} for i in xrange(0, 100)]).run(c)
+
+        for multiplex in [False, True]:
+            c = r.connect(port=self.port, multiplex=multiplex)
+            cursor = r.table('t1').run(c, max_batch_rows=10, prefetch=2)
+            rows = iter(cursor)
+            next(rows)
+            c.close(noreply_wait=False)
+            self.assertRaisesRegexp(
+                r.RqlDriverError, "Connection is closed.",
+                list, rows)
+            cursor.close()
+
+    def test_query_timeout(self):
+        c = r.connect(port=self.port)
+        self.assertRaisesRegexp(
+            r.RqlTimeoutError, "Timed out waiting for the query result.",
+            r.js('while(true) {}', timeout=1).run, c, timeout=0.2)
+
+        # The connection is still usable once the server is done with the query
+        self.assertEqual(r.expr(1).run(c), 1)
+
+        r.db('test').table_create('t1').run(c)
+        r.table('t1').insert([{'id':i} for i in xrange(0, 1000)]).run(c)
+        cursor = r.table('t1').run(c, timeout=5, max_batch_rows=10)
+        self.assertEqual(len(list(cursor)), 1000)
+
+        self.assertRaisesRegexp(
+            r.RqlDriverError, "The timeout run option must be positive.",
+            r.expr(1).run, c, timeout=0)
+
     def test_use_outdated(self):
         c = r.connect(port=self.port)
         r.db('test').table_create('t1').run(c)
@@ -313,6 +525,175 @@ class TestConnection(TestWithConnection):
             "Could not convert port abc to an integer.",
             lambda: r.connect(port='abc'))
 
+class TestMultiplexedConnection(TestWithConnection):
+    def test_connect(self):
+        c = r.connect(port=self.port, multiplex=True)
+        self.assertEqual(type(c), r.MultiplexedConnection)
+        self.assertEqual(r.expr(1).run(c), 1)
+        c.close()
+        self.assertRaisesRegexp(
+            r.RqlDriverError, "Connection is closed.",
+            r.expr(1).run, c)
+
+    def test_shared_between_threads(self):
+        c = r.connect(port=self.port, multiplex=True)
+        r.db('test').table_create('t1').run(c)
+        r.table('t1').insert([{'id':i} for i in xrange(0, 100)]).run(c)
+
+        errors = []
+        def worker(i):
+            try:
+                for j in xrange(0, 10):
+                    self.assertEqual(r.expr(i * j).run(c), i * j)
+                    self.assertEqual(len(list(r.table('t1').run(c))), 100)
+            except Exception as err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in xrange(0, 20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def test_results_by_thread(self):
+        c = r.connect(port=self.port, multiplex=True)
+        r.db('test').table_create('t1').run(c)
+        r.table('t1').insert([{'id':i} for i in xrange(0, 100)]).run(c)
+
+        # Each thread gets the results of its own queries, whatever order the
+        # responses come in on the shared socket
+        results = { }
+        errors = []
+        def worker(i):
+            try:
+                rows = r.table('t1').filter(r.row['id'] % 4 == i).run(c, max_batch_rows=5)
+                results[i] = (sorted(row['id'] for row in rows), r.expr(i).run(c))
+            except Exception as err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in xrange(0, 4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        self.assertEqual(results, dict((i, (range(i, 100, 4), i)) for i in xrange(0, 4)))
+
+    def test_cursor_accounting(self):
+        c = r.connect(port=self.port, multiplex=True)
+        r.db('test').table_create('t1').run(c)
+        r.table('t1').insert([{'id':i} for i in xrange(0, 1000)]).run(c)
+
+        # The reader thread adds batches while they are being taken off the
+        # cursor, none of the buffered bytes may get lost either way
+        for i in xrange(0, 10):
+            cursor = r.table('t1').run(c, prefetch=5, max_batch_rows=10)
+            self.assertEqual(len(list(cursor)), 1000)
+            self.assertEqual(cursor.buffered_bytes, 0)
+            self.assertEqual(cursor.response_sizes, [])
+
+    def test_run_async(self):
+        c = r.connect(port=self.port, multiplex=True)
+        futures = [r.expr(i).run_async(c) for i in xrange(0, 100)]
+        self.assertEqual([f.result() for f in futures], range(0, 100))
+
+        done = threading.Event()
+        results = []
+        def callback(future):
+            results.append(future.result())
+            done.set()
+        r.expr(1).run_async(c).add_done_callback(callback)
+        done.wait(5)
+        self.assertEqual(results, [1])
+
+        self.assertRaisesRegexp(
+            r.RqlRuntimeError, "Division by zero",
+            (r.expr(1) / 0).run_async(c).result)
+
+        self.assertRaisesRegexp(
+            r.RqlDriverError, "Asynchronous queries require a multiplexed connection.",
+            r.expr(1).run_async, r.connect(port=self.port))
+
+    def test_cursor_async(self):
+        c = r.connect(port=self.port, multiplex=True)
+        r.db('test').table_create('t1').run(c)
+        r.table('t1').insert([{'id':i} for i in xrange(0, 100)]).run(c)
+
+        cursor = r.table('t1').run_async(c).result()
+        rows = []
+        while True:
+            batch = cursor.next_batch_async().result()
+            if batch is None:
+                break
+            rows.extend(batch)
+        self.assertEqual(len(rows), 100)
+
+        cursor = r.table('t1').run_async(c).result()
+        cursor.close_async().result()
+
+        # A cursor that can't be closed asynchronously can still be closed
+        c = r.connect(port=self.port)
+        cursor = r.table('t1').run(c, max_batch_rows=10)
+        self.assertRaisesRegexp(
+            r.RqlDriverError, "Asynchronous queries require a multiplexed connection.",
+            cursor.close_async)
+        self.assertFalse(cursor.end_flag)
+        cursor.close()
+        self.assertEqual(c.cursor_cache, { })
+
+class TestConnectionPool(TestWithConnection):
+    def test_reuse(self):
+        pool = r.ConnectionPool(port=self.port, max_size=2)
+        with pool.connection() as c1:
+            r.expr(1).run(c1)
+        with pool.connection() as c2:
+            r.expr(1).run(c2)
+        self.assertIs(c1, c2)
+        pool.close()
+        self.assertRaisesRegexp(
+            r.RqlDriverError, "Connection pool is closed.",
+            pool.get)
+
+    def test_wait_timeout(self):
+        pool = r.ConnectionPool(port=self.port, max_size=1, wait_timeout=0.2)
+        c = pool.get()
+        self.assertRaisesRegexp(
+            r.RqlDriverError, "Timed out waiting for a connection from the pool.",
+            pool.get)
+        pool.put(c)
+        pool.put(pool.get())
+
+    def test_idle_eviction(self):
+        pool = r.ConnectionPool(port=self.port, min_size=1, max_size=3, max_idle_time=0.1)
+        conns = [pool.get() for i in xrange(0, 3)]
+        for c in conns:
+            pool.put(c)
+        sleep(0.2)
+        pool.put(pool.get())
+        self.assertEqual(len(pool._idle), 1)
+
+    def test_health_check(self):
+        pool = r.ConnectionPool(port=self.port, max_size=1, check_interval=0)
+        c = pool.get()
+        c.socket.shutdown(socket.SHUT_RDWR)
+        pool.put(c)
+        with pool.connection() as c:
+            self.assertEqual(r.expr(1).run(c), 1)
+
+    def test_close_broken(self):
+        pool = r.ConnectionPool(port=self.port, max_size=2)
+        conns = [pool.get() for i in xrange(0, 2)]
+        for c in conns:
+            pool.put(c)
+
+        # A broken idle connection doesn't keep the others open
+        conns[0].socket.shutdown(socket.SHUT_RDWR)
+        pool.close()
+        self.assertEqual([c.socket for c in conns], [None, None])
+
 class TestShutdown(TestWithConnection):
     def test_shutdown(self):
         c = r.connect(port=self.port)
@@ -333,6 +714,136 @@ class TestPrinting(unittest.TestCase):
     def runTest(self):
         self.assertEqual(str(r.db('db1').table('tbl1').map(lambda x: x)),
                             "r.db('db1').table('tbl1').map(lambda var_1: var_1)")
+        self.assertEqual(str(r.expr([1, {'a': [2, 'b']}]).contains(1)),
+                            "r.expr([1, {'a': [2, 'b']}]).contains(1)")
+
+        # Vars are numbered by their position in the lambdas around them
+        self.assertEqual(str(r.table('a').map(lambda x: r.table('b').filter(lambda y: y['id'] == x['id'])).reduce(lambda x, y: x)),
+                            "r.table('a').map(lambda var_1: r.table('b').filter(lambda var_2: (var_2['id'] == var_1['id'])))" +
+                            ".reduce(lambda var_1, var_2: var_1)")
+
+class TestEncoding(unittest.TestCase):
+
+    # The direct encoder has to produce the same bytes as protobuf
+    def runTest(self):
+        from rethinkdb import ql2_pb2
+        from rethinkdb.encode import encode_term, encode_start
+        queries = [r.expr(None), r.expr(True), r.expr(False), r.expr(1.5), r.expr(2**40), r.expr(u'h\xe9llo'),
+                   r.expr('x' * 300), r.expr({u'\xe9':[1, None]}), r.expr([r.now(), {'a':r.js('1')}]),
+                   r.db('db1').table('tbl1').filter(lambda x: x['a'] > 5).order_by(r.desc('b')).limit(10),
+                   r.table('tbl1').insert([{'id':i} for i in xrange(0, 100)], upsert=True)]
+        for query in queries:
+            term = ql2_pb2.Term()
+            query.build(term)
+            self.assertEqual(encode_term(query), term.SerializeToString())
+
+        optargs = [('db', r.db('db1')), ('profile', r.expr(True))]
+        pb_query = ql2_pb2.Query()
+        pb_query.type = ql2_pb2.Query.START
+        pb_query.token = 2**40
+        pb_query.accepts_r_json = True
+        for k, v in optargs:
+            pair = pb_query.global_optargs.add()
+            pair.key = k
+            v.build(pair.val)
+        queries[-1].build(pb_query.query)
+        self.assertEqual(encode_start(2**40, optargs, encode_term(queries[-1]), True), pb_query.SerializeToString())
+
+        # Responses with R_JSON datums only are read without protobuf
+        from rethinkdb.decode import decode_response
+        response = ql2_pb2.Response()
+        response.type = ql2_pb2.Response.SUCCESS_PARTIAL
+        response.token = 2**40
+        for value in [u'"\u2603"', '{"a":[1,2]}', '"%s"' % ('x' * 300)]:
+            datum = response.response.add()
+            datum.type = ql2_pb2.Datum.R_JSON
+            datum.r_str = value
+        data = bytearray(response.SerializeToString())
+        decoded = decode_response(data, 0, len(data))
+        self.assertEqual((decoded.type, decoded.token), (response.type, response.token))
+        self.assertEqual([datum.r_str for datum in decoded.response], [datum.r_str for datum in response.response])
+        self.assertEqual((decoded.profile, list(decoded.backtrace.frames)), (None, []))
+
+        # Anything else is left to protobuf
+        response.profile.type = ql2_pb2.Datum.R_NULL
+        data = bytearray(response.SerializeToString())
+        self.assertEqual(decode_response(data, 0, len(data)), None)
+
+class TestProfile(unittest.TestCase):
+    def runTest(self):
+        from rethinkdb import profile
+        tasks = [{'description':'Evaluating filter.', 'duration(ms)':10.0, 'sub_tasks':[
+                     {'description':'Evaluating table.', 'duration(ms)':2.0, 'sub_tasks':[]},
+                     {'parallel_tasks':[[{'description':'Perform read on shard.', 'duration(ms)':3.0, 'sub_tasks':[]}],
+                                        [{'description':'Perform read on shard.', 'duration(ms)':4.0, 'sub_tasks':[]}]]},
+                     {'description':'Filtering eagerly.', 'mean_duration(ms)':0.01, 'n_samples':100}]}]
+
+        root = profile.parse({'value':None, 'profile':tasks})
+        self.assertEqual(root.duration, 10.0)
+        self.assertEqual(root.children[0].term, 'filter')
+        self.assertEqual(root.children[0].self_time, 3.0)
+        self.assertEqual(profile.rollup(tasks), {'filter':(1, 3.0, 10.0), 'table':(1, 2.0, 2.0)})
+        self.assertEqual(profile.folded_stacks(tasks).split('\n'),
+                         ['query;Evaluating filter. 3000',
+                          'query;Evaluating filter.;Evaluating table. 2000',
+                          'query;Evaluating filter.;Filtering eagerly. 1000',
+                          'query;Evaluating filter.;parallel;branch;Perform read on shard. 7000'])
+
+        faster = [{'description':'Evaluating filter.', 'duration(ms)':5.0, 'sub_tasks':[]}]
+        self.assertEqual(profile.diff(tasks, faster)[0],
+                         ('query;Evaluating filter.;parallel;branch;Perform read on shard.', 7.0, 0.0))
+
+class TestTimeFormats(unittest.TestCase):
+    def runTest(self):
+        import datetime
+        from rethinkdb.ast import Datum, deconstruct_batch
+        from rethinkdb.decode import JsonDatum
+        batch = [JsonDatum('{"id":%d,"at":{"$reql_type$":"TIME","epoch_time":%d.5,"timezone":"-07:00"}}' % (i, 1390000000 + i))
+                 for i in xrange(0, 3)]
+
+        rows = deconstruct_batch(batch, 'native')
+        self.assertEqual(rows, [Datum.deconstruct(datum, 'native') for datum in batch])
+        self.assertEqual(rows[0]['at'], datetime.datetime.fromtimestamp(1390000000.5, r.make_timezone('-07:00')))
+        self.assertEqual(rows[0]['at'].tzinfo.tzname(None), '-07:00')
+        self.assertTrue(rows[0]['at'].tzinfo is rows[1]['at'].tzinfo)
+
+        self.assertEqual(deconstruct_batch(batch, 'epoch'), [{'id':i, 'at':1390000000.5 + i} for i in xrange(0, 3)])
+        self.assertEqual(deconstruct_batch(batch, 'raw')[0]['at']['$reql_type$'], 'TIME')
+
+class TestLazyDocument(unittest.TestCase):
+    def runTest(self):
+        from rethinkdb.ast import LazyDocument
+        self.assertEqual(LazyDocument('{"s":"\\"x\\": 5", "x" : 1}')['x'], 1)
+        self.assertEqual(LazyDocument('{"a":"[{\\\\","x":2}')['x'], 2)
+        self.assertEqual(LazyDocument('{"a":{"x":2}}').get('x'), None)
+
+        # The server sorts the keys, so the same key often comes first in
+        # nested documents. Finding the top-level one takes a single pass.
+        children = ','.join(['{"name":"child %d"}' % i for i in xrange(0, 8000)])
+        doc = LazyDocument('{"children":[%s],"name":"parent"}' % children)
+        start = time()
+        self.assertEqual(doc['name'], 'parent')
+        self.assertLess(time() - start, 1)
+        self.assertEqual(len(doc['children']), 8000)
+
+class TestLazyImport(unittest.TestCase):
+
+    # Importing the driver doesn't load the protobuf messages, only the
+    # docstrings
+    def runTest(self):
+        import os, sys, subprocess
+        script = "import sys, time\n" + \
+                 "start = time.time()\n" + \
+                 "import rethinkdb\n" + \
+                 "elapsed = time.time() - start\n" + \
+                 "print elapsed, 'rethinkdb.ql2_pb2' in sys.modules, 'rethinkdb.docs' in sys.modules\n"
+        driver_dir = os.path.dirname(os.path.dirname(os.path.abspath(r.__file__)))
+
+        env = dict(os.environ, PYTHONPATH=driver_dir)
+        elapsed, protobuf, docs = subprocess.check_output([sys.executable, '-c', script], env=env).split()
+        print "Imported the driver in %.2fms" % (float(elapsed) * 1000)
+        self.assertEqual(protobuf, 'False')
+        self.assertEqual(docs, 'True')
 
 class TestBatching(TestWithConnection):
     def runTest(self):
@@ -372,6 +883,54 @@ class TestBatching(TestWithConnection):
         self.assertGreaterEqual(len(cursor.responses), 1)
         self.assertGreaterEqual(len(cursor.responses[0].response), 1)
 
+class TestPrefetch(TestWithConnection):
+    def runTest(self):
+        c = r.connect(port=self.port)
+        r.db('test').table_create('t1').run(c)
+        t1 = r.table('t1')
+        t1.insert([{'id':i} for i in xrange(0, 5000)]).run(c)
+
+        for prefetch in [1, 2, 5]:
+            cursor = t1.run(c, prefetch=prefetch, batch_conf={'max_els':100})
+            self.assertLessEqual(cursor.outstanding_requests, prefetch)
+            self.assertEqual(len(list(cursor)), 5000)
+
+        # Nothing is requested ahead of time once the byte limit is reached
+        cursor = t1.run(c, prefetch=5, prefetch_bytes=1, batch_conf={'max_els':100})
+        self.assertEqual(cursor.outstanding_requests, 0)
+        self.assertEqual(len(list(cursor)), 5000)
+
+        # Each batch is read as a list
+        batches = list(t1.run(c, prefetch=2, batch_conf={'max_els':100}).batches())
+        self.assertEqual(len(batches), 50)
+        self.assertEqual(sum(len(batch) for batch in batches), 5000)
+
+        self.assertRaisesRegexp(
+            r.RqlDriverError, "The prefetch run option must be at least 1.",
+            t1.run, c, prefetch=0)
+
+class TestBatchConf(TestWithConnection):
+    def runTest(self):
+        c = r.connect(port=self.port)
+        r.db('test').table_create('t1').run(c)
+        t1 = r.table('t1')
+        t1.insert([{'id':i} for i in xrange(0, 1000)]).run(c)
+
+        cursor = t1.run(c, max_batch_rows=10, max_batch_seconds=1)
+        self.assertEqual(cursor.batch_conf, {'max_els':10, 'max_dur':1000000})
+        self.assertEqual(len(cursor.responses[0].response), 10)
+        self.assertEqual(len(list(cursor)), 1000)
+
+        # The window never grows past the given prefetch
+        cursor = t1.run(c, adaptive_prefetch=True, prefetch=4, max_batch_rows=10)
+        self.assertEqual(cursor.prefetch, 1)
+        self.assertEqual(len(list(cursor)), 1000)
+        self.assertLessEqual(cursor.prefetch, 4)
+
+        self.assertRaisesRegexp(
+            r.RqlDriverError, "The max_batch_rows run option must be positive.",
+            t1.run, c, max_batch_rows=0)
+
 # # TODO: test cursors, streaming large values
 
 if __name__ == '__main__':
@@ -384,9 +943,18 @@ if __name__ == '__main__':
     suite.addTest(loader.loadTestsFromTestCase(TestTimeout))
     suite.addTest(loader.loadTestsFromTestCase(TestAuthConnection))
     suite.addTest(loader.loadTestsFromTestCase(TestConnection))
+    suite.addTest(loader.loadTestsFromTestCase(TestMultiplexedConnection))
+    suite.addTest(loader.loadTestsFromTestCase(TestConnectionPool))
     suite.addTest(loader.loadTestsFromTestCase(TestShutdown))
     suite.addTest(TestPrinting())
+    suite.addTest(TestEncoding())
+    suite.addTest(TestProfile())
+    suite.addTest(TestTimeFormats())
+    suite.addTest(TestLazyDocument())
+    suite.addTest(TestLazyImport())
     suite.addTest(TestBatching())
+    suite.addTest(TestPrefetch())
+    suite.addTest(TestBatchConf())
 
     res = unittest.TextTestRunner(verbosity=2).run(suite)
 